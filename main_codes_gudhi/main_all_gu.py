@@ -1,62 +1,222 @@
 import os
 import sys
+import hashlib
+import traceback
 import yaml
 import json
+import numpy as np
 import rasterio
-from .raster_utils import preprocess_raster
+from concurrent.futures import ProcessPoolExecutor
+from rasterio.enums import Resampling
+from .raster_utils import preprocess_raster, preprocess_raster_lowmem, get_raster_stats_streamed, run_with_peak_memory
+from .raster_utils import open_raster, get_down_sample_factor, get_decimated_shape
+from . import tile_utils
 from . import mdl1_bolPH_gu
 from . import mdl2_simp_bol
 from . import mdl_eval
 from .visualization import visualize_results,count_buildings
+from utils.mdl_io import DiskCache, hash_file, OUT_FORMAT_EXT
+from utils.mdl_geo import polys2Arrs, arrs2Polys
 
 sys.path.append(os.path.dirname(os.path.abspath(__file__)))
 
-def load_raster(file_path):
+def load_raster(file_path, pre_raster_size=None, down_sample_factor=2):
     with rasterio.open(file_path) as src:
-        image = src.read(1)  # Read the first band
-        return image, src.transform
+        factor = get_down_sample_factor(src.height, src.width, pre_raster_size, down_sample_factor)
+        if factor == 1:
+            image = src.read(1)  # Read the first band
+            return image, src.transform
+
+        # read at reduced resolution, GDAL uses the internal overviews if there are
+        out_shape, transform = get_decimated_shape(src, factor)
+        image = src.read(1, out_shape=out_shape, resampling=Resampling.average)
+        print(f"Raster {file_path} is read at 1/{factor} resolution: {src.shape} -> {out_shape}")
+        return image, transform
+
+def preprocess_by_cfg(raster_image, preprocess_cfg, value_range=None, threshold=None):
+    if preprocess_cfg.get("is_low_mem", False):
+        return preprocess_raster_lowmem(raster_image, value_range=value_range, threshold=threshold,
+                                        otsu_sample_step=preprocess_cfg.get("otsu_sample_step", 1))
+    return preprocess_raster(raster_image, value_range=value_range, threshold=threshold)
+
+def get_building_outlines_tiled(file_path, tile_size=1024, tile_overlap=32, contour_backend="global", min_pixels=0,
+                                preprocess_cfg=None, pre_raster_size=None, down_sample_factor=2):
+    # read the raster window by window, so the peak memory depends on tile_size instead of the raster size
+    preprocess_cfg = preprocess_cfg if preprocess_cfg is not None else {}
+    # normalise and threshold all tiles with the parameters of the whole raster,
+    # so that the binary mask is the same on both sides of a seam and background-only tiles stay background
+    value_range, threshold = get_raster_stats_streamed(file_path, tile_size=tile_size,
+                                                       otsu_sample_step=preprocess_cfg.get("otsu_sample_step", 1),
+                                                       pre_raster_size=pre_raster_size,
+                                                       down_sample_factor=down_sample_factor)
+
+    building_outlines, seam_outlines, seam_is_outers = [], [], []
+    with open_raster(file_path, pre_raster_size, down_sample_factor) as src:
+        # find_contours() keeps the foreground on the same side, so the outer contours are counter-clockwise
+        # in map coordinates iff the transform keeps the orientation
+        is_outer_ccw = src.transform.determinant > 0
+        for read_window, core_window in tile_utils.get_tile_windows(src.height, src.width, tile_size, tile_overlap):
+            tile_image = src.read(1, window=read_window)
+            tile_transform = src.window_transform(read_window)
+
+            preprocessed_tile = preprocess_by_cfg(tile_image, preprocess_cfg, value_range=value_range,
+                                                  threshold=threshold)
+            preprocessed_tile, tile_transform = tile_utils.pad_binary_tile(preprocessed_tile, tile_transform)
+            tile_outlines = mdl1_bolPH_gu.get_building_outlines_from_raster(preprocessed_tile, tile_transform,
+                                                                            backend=contour_backend,
+                                                                            min_pixels=min_pixels)
+
+            core_geo, seam_geo = tile_utils.get_core_geo(src.transform, core_window, src.height, src.width)
+            # the outer contours of the buildings and the contours of their holes have opposite orientations,
+            # they are stitched separately, see stitch_seam_outlines()
+            for is_outer in [True, False]:
+                tile_inner_outlines, tile_seam_outlines = tile_utils.split_outlines_by_core(
+                    [_ for _ in tile_outlines if _.exterior.is_ccw == (is_outer == is_outer_ccw)], core_geo, seam_geo)
+                building_outlines += tile_inner_outlines
+                seam_outlines += tile_seam_outlines
+                seam_is_outers += [is_outer] * len(tile_seam_outlines)
+
+    # merge the outlines crossing tile seams into single buildings
+    building_outlines += tile_utils.stitch_seam_outlines(seam_outlines, seam_is_outers)
+    return building_outlines
+
+def get_building_outlines(raster_path, cfg):
+    # return: building_outlines, binary mask (None in tiled mode, the whole mask is never in memory)
+    tile_cfg = cfg["params"].get("tile", {})
+    contour_cfg = cfg["params"].get("contour", {})
+    preprocess_cfg = cfg["params"].get("preprocess", {})
+    contour_backend = contour_cfg.get("backend", "global")
+    min_pixels = contour_cfg.get("min_pixels", 0)
+    pre_raster_size = cfg["params"].get("pre_raster_size", None)
+    down_sample_factor = cfg["params"].get("down_sample_factor", 2)
+
+    if tile_cfg.get("is_tiled", False):
+        building_outlines = get_building_outlines_tiled(raster_path,
+                                                        tile_size=tile_cfg.get("tile_size", 1024),
+                                                        tile_overlap=tile_cfg.get("tile_overlap", 32),
+                                                        contour_backend=contour_backend,
+                                                        min_pixels=min_pixels,
+                                                        preprocess_cfg=preprocess_cfg,
+                                                        pre_raster_size=pre_raster_size,
+                                                        down_sample_factor=down_sample_factor)
+        preprocessed_raster = None
+    else:
+        raster_image, transform = load_raster(raster_path, pre_raster_size, down_sample_factor)
+
+        preprocessed_raster = preprocess_by_cfg(raster_image, preprocess_cfg)
+        # padded as the tiles, so that the contours touching the raster border are closed along the border
+        # instead of by a chord between their ends
+        preprocessed_pad, transform_pad = tile_utils.pad_binary_tile(preprocessed_raster, transform)
+        building_outlines = mdl1_bolPH_gu.get_building_outlines_from_raster(preprocessed_pad, transform_pad,
+                                                                            backend=contour_backend,
+                                                                            min_pixels=min_pixels)
+    return building_outlines, preprocessed_raster
+
+def get_stage1_cache_key(raster_path, cfg):
+    # raster content + all parameters that change the binary mask or the outlines
+    params = cfg["params"]
+    stage1_params = {k: params.get(k) for k in ["pre_raster_size", "down_sample_factor", "tile", "contour"]}
+    stage1_params["preprocess"] = {k: v for k, v in params.get("preprocess", {}).items() if k != "is_report_mem"}
+    key_str = f"stage1-v2:{hash_file(raster_path)}:{json.dumps(stage1_params, sort_keys=True)}"
+    return hashlib.sha256(key_str.encode()).hexdigest()
+
+def get_building_outlines_cached(raster_path, cfg):
+    # stage-1 results are cached on disk, so runs which only change the simplification parameters skip stage 1
+    cache_cfg = cfg["params"].get("cache", {})
+    if not cache_cfg.get("is_cache", False):
+        return get_building_outlines(raster_path, cfg)[0]
+
+    cache = DiskCache(cache_cfg.get("cache_folder", "output/cache/"), max_size_mb=cache_cfg.get("max_size_mb", 1024))
+    cache_key = get_stage1_cache_key(raster_path, cfg)
+    cache_arrs = cache.load(cache_key)
+    if cache_arrs is not None:
+        print(f"Loaded building outlines of {raster_path} from cache: {cache.get_path(cache_key)}")
+        return arrs2Polys(cache_arrs["coords"], cache_arrs["ring_offsets"], cache_arrs["poly_offsets"])
+
+    building_outlines, binary_mask = get_building_outlines(raster_path, cfg)
+    cache_arrs = polys2Arrs(building_outlines)
+    if binary_mask is not None:
+        cache_arrs["mask"] = np.packbits(binary_mask, axis=None)
+        cache_arrs["mask_shape"] = np.asarray(binary_mask.shape)
+    cache.save(cache_key, **cache_arrs)
+    return building_outlines
+
+def process_raster(raster_file, cfg):
+    raster_folder = cfg["data"]["input"]["raster_folder"]
+    raster_path = os.path.join(raster_folder, raster_file)
+
+    if cfg["params"].get("preprocess", {}).get("is_report_mem", False):
+        building_outlines, mem_peak = run_with_peak_memory(get_building_outlines_cached, raster_path, cfg)
+        print(f"Peak memory of loading, preprocessing and contour extraction: {mem_peak / 2 ** 20:.1f} MiB")
+    else:
+        building_outlines = get_building_outlines_cached(raster_path, cfg)
+
+    print(f"Number of building outlines detected: {len(building_outlines)}")
+    # Use the base name of the raster file (without extension) for the output JSON
+    base_name = os.path.splitext(raster_file)[0]
+    out_format = cfg["data"]["output"].get("out_format", "geojson")
+    with rasterio.open(raster_path) as src:
+        crs_wkt = src.crs.to_wkt() if src.crs is not None else None
+
+    feature_num, simplified_outlines = mdl2_simp_bol.main_simp_ol(
+        building_outlines,
+        out_folder=cfg["data"]["output"]["out_simp_folder"],
+        bld_list=[base_name],  # Pass the JSON filename here
+        bfr_tole=cfg["params"]["bfr_tole"],
+        bfr_otdiff=cfg["params"]["bfr_otdiff"],
+        simp_method=cfg["params"]["simp"]["type"],
+        is_fix_invalid=cfg["params"]["simp"].get("is_fix_invalid", False),
+        out_format=out_format,
+        crs_wkt=crs_wkt
+    )
+
+    ph_shape_path = os.path.join(cfg["data"]["output"]["out_simp_folder"], f"{base_name}{OUT_FORMAT_EXT[out_format]}")
+    output_path = os.path.join(cfg["data"]["output"]["out_simp_folder"], f"{base_name}_visualization.png")
+
+    print(f"Attempting to visualize results:")
+    print(f"  Raster path: {raster_path}")
+    print(f"  PH shape path: {ph_shape_path}")
+    print(f"  Output path: {output_path}")
+
+    visualize_results(raster_path, ph_shape_path, output_path)
+
+    num_buildings = count_buildings(ph_shape_path)
+    return num_buildings
+
+def process_rasters_parallel(raster_files, cfg, n_workers):
+    # each raster is sent to a worker process, results are collected in the order of raster_files,
+    # a failed raster is recorded instead of stopping the whole batch
+    results, failures = {}, {}
+    with ProcessPoolExecutor(max_workers=min(n_workers, len(raster_files))) as executor:
+        futures = [executor.submit(process_raster, raster_file, cfg) for raster_file in raster_files]
+        for raster_file, future in zip(raster_files, futures):
+            try:
+                results[raster_file] = future.result()
+            except Exception:
+                failures[raster_file] = traceback.format_exc()
+                print(f"Failed to process {raster_file}:\n{failures[raster_file]}")
+
+    return results, failures
 
 def main(cfg):
     os.makedirs(cfg["data"]["output"]["out_simp_folder"], exist_ok=True)
     os.makedirs(cfg["data"]["output"]["out_eval_folder"], exist_ok=True)
     print(f"Created output directories: {cfg['data']['output']['out_simp_folder']}, {cfg['data']['output']['out_eval_folder']}")
 
-    raster_folder = cfg["data"]["input"]["raster_folder"]
     raster_files = cfg["data"]["input"]["raster_files"]
+    n_workers = cfg["params"].get("n_workers", 1)
 
-    for raster_file in raster_files:
-        raster_path = os.path.join(raster_folder, raster_file)
-        raster_image, transform = load_raster(raster_path)
-        
-        preprocessed_raster = preprocess_raster(raster_image)
-        building_outlines = mdl1_bolPH_gu.get_building_outlines_from_raster(preprocessed_raster, transform)
-
-        print(f"Number of building outlines detected: {len(building_outlines)}")
-        # Use the base name of the raster file (without extension) for the output JSON
-        base_name = os.path.splitext(raster_file)[0]
-        
-        simplified_outlines = mdl2_simp_bol.main_simp_ol(
-            building_outlines,
-            out_folder=cfg["data"]["output"]["out_simp_folder"],
-            bld_list=[base_name],  # Pass the JSON filename here
-            bfr_tole=cfg["params"]["bfr_tole"],
-            bfr_otdiff=cfg["params"]["bfr_otdiff"],
-            simp_method=cfg["params"]["simp"]["type"]
-        )
-        
-        ph_shape_path = os.path.join(cfg["data"]["output"]["out_simp_folder"], f"{base_name}.json")
-        output_path = os.path.join(cfg["data"]["output"]["out_simp_folder"], f"{base_name}_visualization.png")
-        
-        print(f"Attempting to visualize results:")
-        print(f"  Raster path: {raster_path}")
-        print(f"  PH shape path: {ph_shape_path}")
-        print(f"  Output path: {output_path}")
-        
-        visualize_results(raster_path, ph_shape_path, output_path)
-
-        num_buildings=count_buildings(ph_shape_path)
+    if n_workers > 1 and len(raster_files) > 1:
+        results, failures = process_rasters_parallel(raster_files, cfg, n_workers)
+        if len(failures) > 0:
+            print(f"{len(failures)} of {len(raster_files)} rasters failed: {list(failures.keys())}")
+    else:
+        results, failures = {}, {}
+        for raster_file in raster_files:
+            results[raster_file] = process_raster(raster_file, cfg)
 
     print("Processing completed.")
+    return results, failures
 
 if __name__ == "__main__":
     config_path = os.path.join(os.path.dirname(os.path.dirname(__file__)), 'config', 'config_raster.yaml')
@@ -1,30 +1,91 @@
 import numpy as np
+from concurrent.futures import ProcessPoolExecutor
+from scipy import ndimage
 from shapely.geometry import Polygon
 from skimage import measure
-import rasterio
 
 
-def get_building_outlines_from_raster(raster_image, transform):
+def contour_to_map_coords(contour, transform):
+    # Same as rasterio.transform.xy(transform, rows, cols) (pixel centers), applied to the whole contour at once
+    rows, cols = contour[:, 0] + 0.5, contour[:, 1] + 0.5
+    xs = cols * transform.a + rows * transform.b + transform.c
+    ys = cols * transform.d + rows * transform.e + transform.f
+    return np.stack((xs, ys), axis=-1)
+
+
+def ring_area(coords):
+    # Shoelace formula, coordinates are shifted to the first vertex to keep precision for large map coordinates
+    xs, ys = coords[:, 0] - coords[0, 0], coords[:, 1] - coords[0, 1]
+    return 0.5 * np.abs(np.dot(xs, np.roll(ys, -1)) - np.dot(ys, np.roll(xs, -1)))
+
+
+def trace_component_contours(component_crop):
+    # Trace the contours of one cropped component, and shift them back to the pixel coordinates of the whole image
+    crop_mask, row_off, col_off = component_crop
+    return [contour + (row_off, col_off) for contour in measure.find_contours(crop_mask, 0.5)]
+
+
+def find_contours_by_component(binary_image, min_pixels=0, min_bbox_pixels=0, margin=1, n_workers=1):
+    # Label connected components (4-connectivity, the same as find_contours(fully_connected="low") separates them),
+    # crop each component to its bounding box plus a margin, and trace contours per crop
+    labels, n_labels = ndimage.label(binary_image)
+    if n_labels == 0:
+        return []
+    pixel_counts = np.bincount(labels.ravel())
+
+    component_crops = []
+    for label_i, bbox in enumerate(ndimage.find_objects(labels), start=1):
+        # drop tiny blobs before tracing
+        if bbox is None or pixel_counts[label_i] < min_pixels:
+            continue
+        bbox_h, bbox_w = bbox[0].stop - bbox[0].start, bbox[1].stop - bbox[1].start
+        if bbox_h * bbox_w <= min_bbox_pixels:
+            continue
+
+        row_st, row_ed = max(bbox[0].start - margin, 0), min(bbox[0].stop + margin, labels.shape[0])
+        col_st, col_ed = max(bbox[1].start - margin, 0), min(bbox[1].stop + margin, labels.shape[1])
+        component_crops.append((labels[row_st:row_ed, col_st:col_ed] == label_i, row_st, col_st))
+
+    if n_workers > 1:
+        with ProcessPoolExecutor(max_workers=n_workers) as executor:
+            contours_per_crop = list(executor.map(trace_component_contours, component_crops,
+                                                  chunksize=max(1, len(component_crops) // (n_workers * 4))))
+    else:
+        contours_per_crop = map(trace_component_contours, component_crops)
+
+    return [contour for crop_contours in contours_per_crop for contour in crop_contours]
+
+
+def get_building_outlines_from_raster(raster_image, transform, min_area=10, backend="global", min_pixels=0,
+                                      n_workers=1):
     # Ensure the image is binary
     threshold = raster_image.mean()
     binary_image = raster_image > threshold
 
     # Find contours
-    contours = measure.find_contours(binary_image, 0.5)
-    
+    if backend == "global":
+        contours = measure.find_contours(binary_image, 0.5)
+    elif backend == "component":
+        # the contours of a component lie in its bbox, so a bbox not larger than min_area can not give a valid outline
+        pixel_area = abs(transform.a * transform.e - transform.b * transform.d)
+        contours = find_contours_by_component(binary_image, min_pixels=min_pixels,
+                                              min_bbox_pixels=min_area / pixel_area, n_workers=n_workers)
+    else:
+        raise ValueError(f"The expected 'backend' is in ['global', 'component'], but {backend} was gotten.")
+
     print(f"Number of contours detected: {len(contours)}")
-    
+
     building_outlines = []
     for contour in contours:
         # Convert pixel coordinates to geospatial coordinates
-        coords = [rasterio.transform.xy(transform, y, x) for y, x in contour]
+        coords = contour_to_map_coords(contour, transform)
         # Close the polygon
-        if coords[0] != coords[-1]:
-            coords.append(coords[0])
-        # Only add polygons with a minimum area (to filter out noise)
-        poly = Polygon(coords)
-        if poly.area > 10:  # Adjust this threshold as needed
-            building_outlines.append(poly)
-    
+        if not np.array_equal(coords[0], coords[-1]):
+            coords = np.vstack((coords, coords[:1]))
+        # Only add polygons with a minimum area (to filter out noise),
+        # the area is checked on the array so that the filtered polygons are never built
+        if coords.shape[0] >= 4 and ring_area(coords) > min_area:  # Adjust this threshold as needed
+            building_outlines.append(Polygon(coords))
+
     print(f"Number of building outlines after filtering: {len(building_outlines)}")
-    return building_outlines
\ No newline at end of file
+    return building_outlines
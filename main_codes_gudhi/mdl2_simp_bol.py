@@ -1,46 +1,76 @@
 import os
 import numpy as np
-from shapely.geometry import Polygon, MultiPolygon
-from utils.mdl_geo import poly2Geojson
-from utils.mdl_io import save_json
+import shapely
+from shapely.geometry import Polygon
+from utils.mdl_io import save_geojson_polys, BuildingWriter, OUT_FORMAT_EXT
 
-def simplify_polygon(polygon, tolerance):
-    return polygon.simplify(tolerance)
+def simplify_polygons(polygons, tolerance, is_fix_invalid=False):
+    # simplify all polygons by one vectorized call over a geometry array, same result as polygon.simplify(tolerance)
+    polygons = np.asarray(polygons, dtype=object)
+    simplified = shapely.simplify(polygons, tolerance)
+
+    # check validity in bulk
+    invalid_mask = ~shapely.is_valid(simplified)
+    if invalid_mask.any():
+        print(f"Number of invalid simplified outlines: {invalid_mask.sum()}")
+        if is_fix_invalid:
+            simplified[invalid_mask] = [get_largest_polygon(_) for _ in shapely.make_valid(simplified[invalid_mask])]
+
+    return simplified
+
+def get_largest_polygon(geom):
+    # make_valid() may return MultiPolygon or GeometryCollection, keep its largest polygon
+    if geom.geom_type == "Polygon":
+        return geom
+    polys = [_ for _ in getattr(geom, "geoms", []) if _.geom_type == "Polygon"]
+    return max(polys, key=lambda _: _.area) if len(polys) > 0 else Polygon()
+
+def save_simp_ol_stream(building_outlines, savename, out_format, bfr_tole=0.5, is_fix_invalid=False, chunk_size=1000,
+                        crs_wkt=None):
+    # simplify chunk by chunk, each building is written as its own feature as soon as its chunk is simplified.
+    # The simplified outlines are not kept, only the number of written features is returned
+    properties_schema = {"bid": "int", "area": "float", "vertex_num": "int"}
+    feature_num = 0
+    with BuildingWriter(savename, out_format, properties_schema=properties_schema, round_precision=6,
+                        crs_wkt=crs_wkt, batch_size=chunk_size) as writer:
+        for chunk_st in range(0, len(building_outlines), chunk_size):
+            chunk_simp = simplify_polygons(building_outlines[chunk_st:chunk_st + chunk_size], bfr_tole,
+                                           is_fix_invalid=is_fix_invalid)
+            chunk_area, chunk_vnum = shapely.area(chunk_simp), shapely.get_num_coordinates(chunk_simp)
+            for i, outline_simp in enumerate(chunk_simp):
+                writer.write(outline_simp, {"bid": chunk_st + i, "area": float(chunk_area[i]),
+                                            "vertex_num": int(chunk_vnum[i])})
+            feature_num += len(chunk_simp)
+
+    return feature_num
 
 def main_simp_ol(building_outlines, out_folder, bld_list, bfr_tole=0.5, bfr_otdiff=0.0, simp_method="haus",
-                 savename_bfr="", is_unrefresh_save=False, is_save_fig=False, is_Debug=False):
+                 savename_bfr="", is_unrefresh_save=False, is_save_fig=False, is_Debug=False, is_fix_invalid=False,
+                 out_format="geojson", chunk_size=1000, crs_wkt=None):
+    # return (the number of saved outlines, the simplified outlines).
+    # The outlines are only kept with out_format="geojson", for the streamed formats they are None
     
     if not isinstance(building_outlines, list):
         building_outlines = [building_outlines]
     
-    simplified_outlines = []
-    for i, outline in enumerate(building_outlines):
-        simplified_outline = simplify_polygon(outline, bfr_tole)
-        simplified_outlines.append(simplified_outline)
-    
-    # Save all simplified outlines in a single GeoJSON file
+    # Save all simplified outlines in a single file
+    out_ext = OUT_FORMAT_EXT[out_format]
     if bld_list and isinstance(bld_list[0], str):
-        savename = os.path.join(out_folder, f"{bld_list[0]}.json")
+        savename = os.path.join(out_folder, f"{bld_list[0]}{out_ext}")
     else:
-        savename = os.path.join(out_folder, "simplified_outlines.json")
+        savename = os.path.join(out_folder, f"simplified_outlines{out_ext}")
     
-    # Create a MultiPolygon from the simplified outlines
-    multi_polygon = MultiPolygon(simplified_outlines)
-    
-    all_outlines_json = poly2Geojson(multi_polygon, round_precision=6)
-    
-    # Wrap the GeoJSON in a FeatureCollection
-    feature_collection = {
-        "type": "FeatureCollection",
-        "features": [{
-            "type": "Feature",
-            "geometry": all_outlines_json,
-            "properties": {}
-        }]
-    }
-    
-    save_json(feature_collection, savename)
-    
-    print(f"Saved {len(simplified_outlines)} simplified outlines to: {savename}")
-    
-    return simplified_outlines
\ No newline at end of file
+    if out_format == "geojson":
+        simplified_outlines = simplify_polygons(building_outlines, bfr_tole, is_fix_invalid=is_fix_invalid)
+        # Write the simplified outlines as one MultiPolygon feature in a FeatureCollection,
+        # directly from the rounded coordinate arrays
+        save_geojson_polys(simplified_outlines, savename, round_precision=6)
+        print(f"Saved {len(simplified_outlines)} simplified outlines to: {savename}")
+        return len(simplified_outlines), list(simplified_outlines)
+
+    # One feature per building, written while simplifying. The memory stays flat,
+    # so the simplified outlines are not returned
+    feature_num = save_simp_ol_stream(building_outlines, savename, out_format, bfr_tole=bfr_tole,
+                                      is_fix_invalid=is_fix_invalid, chunk_size=chunk_size, crs_wkt=crs_wkt)
+    print(f"Saved {feature_num} simplified outlines to: {savename}")
+    return feature_num, None
\ No newline at end of file
@@ -1,18 +1,176 @@
+import tracemalloc
+from contextlib import contextmanager
 import numpy as np
+import rasterio
+from rasterio.enums import Resampling
+from rasterio.transform import Affine
+from rasterio.vrt import WarpedVRT
+from scipy import ndimage
 from skimage import filters
+from .tile_utils import get_tile_windows
+
+def get_down_sample_factor(height, width, pre_raster_size=None, down_sample_factor=2):
+    # decimate by down_sample_factor until the longer side of the raster is not larger than pre_raster_size
+    factor = 1
+    if pre_raster_size is None or down_sample_factor <= 1:
+        return factor
+    while max(height, width) / factor > pre_raster_size:
+        factor *= down_sample_factor
+    return factor
+
+def get_decimated_shape(src, factor):
+    # (out_shape, transform) of the raster read at 1/factor resolution
+    out_shape = (max(1, round(src.height / factor)), max(1, round(src.width / factor)))
+    transform = src.transform * Affine.scale(src.width / out_shape[1], src.height / out_shape[0])
+    return out_shape, transform
+
+@contextmanager
+def open_raster(file_path, pre_raster_size=None, down_sample_factor=2):
+    """
+    open a raster, as a decimated virtual raster if its longer side is larger than pre_raster_size,
+    so that the windowed reads get the reduced resolution directly (GDAL reads the internal overviews if there are)
+    :param file_path:          path of the raster
+    :param pre_raster_size:    the max. side length (pixels) of the raster to be processed, None: no limit
+    :param down_sample_factor: the raster is decimated by down_sample_factor until it meets pre_raster_size
+    :return:
+        the opened dataset (rasterio dataset or WarpedVRT)
+    """
+    with rasterio.open(file_path) as src:
+        factor = get_down_sample_factor(src.height, src.width, pre_raster_size, down_sample_factor)
+        if factor == 1:
+            yield src
+        else:
+            out_shape, transform = get_decimated_shape(src, factor)
+            with WarpedVRT(src, height=out_shape[0], width=out_shape[1], transform=transform,
+                           resampling=Resampling.average) as vrt:
+                yield vrt
+
+def preprocess_raster(raster_image, value_range=None, threshold=None):
+    # value_range / threshold: fixed (min, max) and threshold, e.g. of the whole raster when the image is a tile.
+    # None: computed from raster_image
+    img_min, img_max = value_range if value_range is not None else (np.min(raster_image), np.max(raster_image))
 
-def preprocess_raster(raster_image):
     # Normalize the image
-    raster_image = (raster_image - np.min(raster_image)) / (np.max(raster_image) - np.min(raster_image))
+    raster_image = (raster_image - img_min) / (img_max - img_min)
     
     # Apply Gaussian smoothing
     smoothed = filters.gaussian(raster_image, sigma=1)
     
     # Apply Otsu's thresholding
-    binary = smoothed > filters.threshold_otsu(smoothed)
+    if threshold is None:
+        threshold = filters.threshold_otsu(smoothed)
+    binary = smoothed > threshold
     
     return binary
 
+def threshold_otsu_from_hist(hist_counts, hist_range):
+    # Otsu's threshold from a (streamed / subsampled) histogram instead of all pixels
+    bin_edges = np.linspace(hist_range[0], hist_range[1], num=len(hist_counts) + 1)
+    bin_centers = (bin_edges[:-1] + bin_edges[1:]) / 2
+    return filters.threshold_otsu(hist=(hist_counts, bin_centers))
+
+def normalize_smooth_lowmem(raster_image, value_range=None, sigma=1):
+    # float32 copy (no copy if the input is float32 already, then it is modified in-place)
+    image = raster_image.astype(np.float32, copy=False)
+    img_min, img_max = value_range if value_range is not None else (image.min(), image.max())
+
+    # Normalize the image in-place
+    image -= img_min
+    image *= 1 / (img_max - img_min)
+
+    # Apply Gaussian smoothing in-place (same kernel and border mode as filters.gaussian)
+    ndimage.gaussian_filter(image, sigma=sigma, output=image, mode="nearest", truncate=4.0)
+    return image
+
+def preprocess_raster_lowmem(raster_image, value_range=None, threshold=None, sigma=1, otsu_sample_step=1, nbins=256):
+    """
+    memory-lean version of preprocess_raster: float32, in-place normalisation and smoothing,
+    Otsu's threshold computed from a histogram of (a subsample of) the pixels
+    :param raster_image:     the raster image. If it is float32, it is overwritten.
+    :param value_range:      (min, max) used for normalisation, e.g. of the whole raster when the image is a tile.
+                             None: the range of raster_image
+    :param threshold:        the threshold of the smoothed image, e.g. from get_raster_stats_streamed().
+                             None: Otsu's threshold of raster_image
+    :param sigma:            sigma of the Gaussian smoothing
+    :param otsu_sample_step: only every n-th pixel (per axis) is used to compute Otsu's threshold
+    :param nbins:            number of histogram bins for Otsu's threshold
+    :return:
+        binary: the binary image
+    """
+    smoothed = normalize_smooth_lowmem(raster_image, value_range=value_range, sigma=sigma)
+
+    # Apply Otsu's thresholding
+    if threshold is None:
+        smoothed_sample = smoothed[::otsu_sample_step, ::otsu_sample_step]
+        hist_range = (float(smoothed_sample.min()), float(smoothed_sample.max()))
+        hist_counts, _ = np.histogram(smoothed_sample, bins=nbins, range=hist_range)
+        threshold = threshold_otsu_from_hist(hist_counts, hist_range)
+
+    binary = smoothed > threshold
+    return binary
+
+def get_raster_stats_streamed(raster_path, tile_size=1024, sigma=1, otsu_sample_step=1, nbins=256,
+                              pre_raster_size=None, down_sample_factor=2):
+    """
+    get the normalisation range and Otsu's threshold of a whole raster by windowed reads,
+    so that rasters larger than the memory can be preprocessed tile by tile with the same global parameters
+    :param raster_path:      path of the raster
+    :param tile_size:        the side length (pixels) of the windows
+    :param sigma:            sigma of the Gaussian smoothing
+    :param otsu_sample_step: only every n-th pixel (per axis) is used to compute Otsu's threshold
+    :param nbins:            number of histogram bins for Otsu's threshold
+    :param pre_raster_size:    see open_raster()
+    :param down_sample_factor: see open_raster()
+    :return:
+        value_range: (min, max) of the raster
+        threshold:   Otsu's threshold of the normalised and smoothed raster
+    """
+    smooth_overlap = int(4.0 * sigma + 0.5)  # radius of the Gaussian kernel
+    with open_raster(raster_path, pre_raster_size, down_sample_factor) as src:
+        # 1. global min / max
+        img_min, img_max = np.inf, -np.inf
+        for _, core_window in get_tile_windows(src.height, src.width, tile_size, 0):
+            tile_image = src.read(1, window=core_window)
+            img_min, img_max = min(img_min, tile_image.min()), max(img_max, tile_image.max())
+
+        def get_smoothed_cores():
+            for read_window, core_window in get_tile_windows(src.height, src.width, tile_size, smooth_overlap):
+                smoothed = normalize_smooth_lowmem(src.read(1, window=read_window), value_range=(img_min, img_max),
+                                                   sigma=sigma)
+                # only the core of each tile, the overlap is counted by the neighbouring tiles
+                row_st, col_st = core_window.row_off - read_window.row_off, core_window.col_off - read_window.col_off
+                yield smoothed[row_st:row_st + core_window.height:otsu_sample_step,
+                               col_st:col_st + core_window.width:otsu_sample_step]
+
+        # 2. min / max of the normalised and smoothed raster, the histogram range of filters.threshold_otsu()
+        hist_min, hist_max = np.inf, -np.inf
+        for smoothed in get_smoothed_cores():
+            hist_min, hist_max = min(hist_min, float(smoothed.min())), max(hist_max, float(smoothed.max()))
+
+        # 3. histogram of the normalised and smoothed raster, accumulated tile by tile
+        hist_counts = np.zeros(nbins, dtype=np.int64)
+        for smoothed in get_smoothed_cores():
+            hist_counts += np.histogram(smoothed, bins=nbins, range=(hist_min, hist_max))[0]
+
+    threshold = threshold_otsu_from_hist(hist_counts, (hist_min, hist_max))
+    return (img_min, img_max), threshold
+
+def run_with_peak_memory(func, *args, **kwargs):
+    # run func and get the peak memory (bytes) allocated during the call, numpy arrays included
+    is_tracing = tracemalloc.is_tracing()
+    if is_tracing:
+        tracemalloc.reset_peak()
+    else:
+        tracemalloc.start()
+    mem_start = tracemalloc.get_traced_memory()[0]
+
+    res = func(*args, **kwargs)
+
+    mem_peak = tracemalloc.get_traced_memory()[1] - mem_start
+    if not is_tracing:
+        tracemalloc.stop()
+    return res, mem_peak
+
 def raster_to_vector(binary_image, transform):
     from rasterio import features
     shapes = features.shapes(binary_image.astype('uint8'), transform=transform)
@@ -0,0 +1,137 @@
+import numpy as np
+from rasterio.transform import Affine
+from rasterio.windows import Window
+from shapely.geometry import Polygon, LineString, MultiLineString
+from shapely.ops import unary_union
+
+
+def get_tile_windows(height, width, tile_size=1024, tile_overlap=32):
+    """
+    split a raster into a grid of tiles
+    :param height:       raster height (rows)
+    :param width:        raster width (cols)
+    :param tile_size:    the side length (pixels) of each tile's core
+    :param tile_overlap: the number of pixels each tile is extended by on every side when it is read
+    :return:
+        a generator of (read_window, core_window).
+        The core windows partition the raster, the read windows are the cores extended by tile_overlap.
+    """
+    for row_off in range(0, height, tile_size):
+        for col_off in range(0, width, tile_size):
+            core_window = Window(col_off, row_off,
+                                 min(tile_size, width - col_off), min(tile_size, height - row_off))
+
+            read_row_st, read_col_st = max(row_off - tile_overlap, 0), max(col_off - tile_overlap, 0)
+            read_row_ed = min(row_off + core_window.height + tile_overlap, height)
+            read_col_ed = min(col_off + core_window.width + tile_overlap, width)
+            read_window = Window(read_col_st, read_row_st, read_col_ed - read_col_st, read_row_ed - read_row_st)
+
+            yield read_window, core_window
+
+
+def get_core_geo(transform, core_window, height, width):
+    """
+    get the core area of a tile and its seams (the core edges shared with other tiles) in map coordinates
+    :param transform:   the affine transform of the whole raster
+    :param core_window: the core window of the tile
+    :param height:      raster height (rows)
+    :param width:       raster width (cols)
+    :return:
+        core_geo: Polygon of the core area
+        seam_geo: MultiLineString of the core edges which are not on the raster border
+    """
+    row_st, col_st = core_window.row_off, core_window.col_off
+    row_ed, col_ed = row_st + core_window.height, col_st + core_window.width
+
+    corners = [transform * (col_st, row_st), transform * (col_ed, row_st),
+               transform * (col_ed, row_ed), transform * (col_st, row_ed)]
+    core_geo = Polygon(corners)
+
+    # edges: top, right, bottom, left
+    edges = [(corners[0], corners[1], row_st > 0),
+             (corners[1], corners[2], col_ed < width),
+             (corners[2], corners[3], row_ed < height),
+             (corners[3], corners[0], col_st > 0)]
+    seam_geo = MultiLineString([LineString([e_st, e_ed]) for e_st, e_ed, is_seam in edges if is_seam])
+
+    return core_geo, seam_geo
+
+
+def split_outlines_by_core(building_outlines, core_geo, seam_geo):
+    """
+    keep the part of each outline in the tile's core, and separate the parts touching a seam
+    :param building_outlines: list of Polygons extracted from the (overlapping) read window of a tile
+    :param core_geo:          Polygon of the tile's core
+    :param seam_geo:          MultiLineString of the tile's seams
+    :return:
+        inner_outlines: outlines completely inside the core, final results
+        seam_outlines:  pieces of outlines touching a seam, need to be stitched with pieces from other tiles
+    """
+    inner_outlines, seam_outlines = [], []
+    for outline in building_outlines:
+        if not outline.intersects(core_geo):
+            continue  # belongs to another tile
+
+        if core_geo.contains(outline) and not outline.intersects(seam_geo):
+            inner_outlines.append(outline)
+            continue
+
+        if not outline.is_valid:
+            outline = outline.buffer(0)
+        outline_core = outline.intersection(core_geo)
+        if outline_core.geom_type == "Polygon":
+            outline_core = [outline_core]
+        else:
+            outline_core = [_ for _ in getattr(outline_core, "geoms", []) if _.geom_type == "Polygon"]
+
+        for piece in outline_core:
+            if piece.is_empty:
+                continue
+            if piece.intersects(seam_geo):
+                seam_outlines.append(piece)
+            else:
+                inner_outlines.append(piece)
+
+    return inner_outlines, seam_outlines
+
+
+def stitch_seam_outlines(seam_outlines, seam_is_outers=None):
+    """
+    merge the outline pieces from neighbouring tiles that belong to the same contour
+    :param seam_outlines:  list of Polygons touching tile seams
+    :param seam_is_outers: list of bool, whether the contour each piece is cut from is the outer contour of a building
+                           (False: the contour of a hole). As in the untiled raster, a hole crossing a seam is its own
+                           outline and the building is filled. A hole reaching the padded side of a tile is not a
+                           contour there, it is a notch of the building piece, so after merging the building pieces
+                           their interiors are merged with the hole pieces.
+                           None: all pieces are merged together
+    :return:
+        list of merged Polygons
+    """
+    if len(seam_outlines) == 0:
+        return []
+    if seam_is_outers is not None:
+        building_outlines = stitch_seam_outlines([_ for _, is_outer in zip(seam_outlines, seam_is_outers) if is_outer])
+        hole_outlines = [_ for _, is_outer in zip(seam_outlines, seam_is_outers) if not is_outer]
+        hole_outlines += [Polygon(ring) for outline in building_outlines for ring in outline.interiors]
+        return [Polygon(_.exterior) for _ in building_outlines] + stitch_seam_outlines(hole_outlines)
+
+    merged = unary_union(seam_outlines)
+    if merged.geom_type == "Polygon":
+        return [merged]
+    return [_ for _ in merged.geoms if _.geom_type == "Polygon"]
+
+
+def pad_binary_tile(binary_tile, tile_transform, pad_width=1):
+    """
+    pad a binary tile with background, so that the contours touching the tile border are closed along the border.
+    The untiled raster is padded the same way, so that the outlines touching the raster border are the same
+    :param binary_tile:    the binary (preprocessed) tile
+    :param tile_transform: the affine transform of the tile
+    :param pad_width:      number of pixels to pad
+    :return:
+        binary_tile_pad, tile_transform_pad
+    """
+    binary_tile_pad = np.pad(binary_tile, pad_width, mode="constant", constant_values=False)
+    tile_transform_pad = tile_transform * Affine.translation(-pad_width, -pad_width)
+    return binary_tile_pad, tile_transform_pad
@@ -4,9 +4,25 @@ import rasterio
 from rasterio.plot import show
 from shapely.geometry import shape, mapping
 
+def load_ph_shape(ph_shape_file):
+    # GeoJSON file as it is; the per-building formats are loaded as a FeatureCollection
+    if ph_shape_file.endswith('.json'):
+        with open(ph_shape_file, 'r') as f:
+            return json.load(f)
+    if ph_shape_file.endswith('.geojsonl'):
+        with open(ph_shape_file, 'r') as f:
+            features = [json.loads(line) for line in f if line.strip()]
+    else:
+        import geopandas as gpd
+        if ph_shape_file.endswith('.parquet'):
+            gdf = gpd.read_parquet(ph_shape_file)
+        else:
+            gdf = gpd.read_file(ph_shape_file)
+        features = gdf.__geo_interface__['features']
+    return {"type": "FeatureCollection", "features": features}
+
 def count_buildings(json_file):
-    with open(json_file, 'r') as f:
-        data = json.load(f)
+    data = load_ph_shape(json_file)
     if 'type' in data and data['type'] == 'FeatureCollection':
         return len(data['features'])
     else:
@@ -26,8 +42,7 @@ def visualize_results(tif_file, ph_shape_file, output_file):
     show(data, ax=ax, cmap='gray')
 
     # Load the PH.Shape results
-    with open(ph_shape_file, 'r') as f:
-        ph_shape_data = json.load(f)
+    ph_shape_data = load_ph_shape(ph_shape_file)
 
     # Count the number of buildings
     num_buildings = count_buildings(ph_shape_file)
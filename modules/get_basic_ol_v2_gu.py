@@ -2,47 +2,163 @@ import numpy as np
 import gudhi as gd
 from scipy.spatial import ConvexHull
 from shapely.geometry import Polygon
+from utils.mdl_PH_gu import get_mst_edge_len2
 
-def get_autooptim_bf_radius_GU(pts, down_sample_num=400, is_down=True, isDebug=False):
-    if is_down:
-        idx = np.random.choice(pts.shape[0], down_sample_num, replace=False)
-        pts_down = pts[idx]
+def get_pers_0d_alpha(pts):
+    # 0-d persistence pairs [birth, death] of the alpha complex (filtration: squared radius)
+    alpha_complex = gd.AlphaComplex(points=pts)
+    simplex_tree = alpha_complex.create_simplex_tree()
+    pers = simplex_tree.persistence()
+    return np.array([p[1] for p in pers if p[0] == 0])
+
+def get_pers_0d_mst(pts):
+    """
+    the same 0-d persistence pairs as get_pers_0d_alpha(), by the Euclidean minimum spanning tree:
+    all components are born at 0, and each MST edge (a Delaunay edge) merges two of them at (edge_length / 2) ** 2,
+    i.e. the squared radius at which the edge enters the alpha complex. O(n log(n)) instead of the whole alpha complex
+    :param pts: shape=[n, 2]
+    :return:
+        pers_0d: shape=[m, 2], [birth, death] without the pairs of 0 persistence, the last death is inf
+    """
+    # duplicated points are merged by the alpha complex, too
+    deaths = get_mst_edge_len2(pts) / 4
+
+    pers_0d = np.zeros((len(deaths) + 1, 2))
+    pers_0d[:-1, 1] = deaths
+    pers_0d[-1, 1] = np.inf
+    return pers_0d
+
+def get_sample_idx(pts, sample_num, sample_mode="random", seed=None, grid_size=16):
+    """
+    the indices of a subsample of pts. With the same seed, a smaller sample is a part of a larger one
+    :param pts:         shape=[n, 2]
+    :param sample_num:  the number of sampled points, all points if it is larger than n
+    :param sample_mode: "random"; "stratified": the points are taken cell by cell from a grid_size x grid_size grid
+                        over the bbox, so that sparse parts are not missed; "fps": farthest point sampling, O(n * sample_num)
+    :param seed:        the seed of the random generator
+    :param grid_size:   ("stratified" only)
+    :return:
+    """
+    pt_num = len(pts)
+    sample_num = min(sample_num, pt_num)
+    rng = np.random.default_rng(seed)
+
+    if sample_mode == "random":
+        return rng.permutation(pt_num)[:sample_num]
+    elif sample_mode == "stratified":
+        pt_min, pt_size = np.min(pts, axis=0), np.ptp(pts, axis=0)
+        cell_xy = ((pts - pt_min) / np.where(pt_size > 0, pt_size, 1) * grid_size).astype(int)
+        cell_id = np.ravel_multi_index(tuple(np.minimum(cell_xy, grid_size - 1).T), (grid_size, grid_size))
+        # the rank of each point in its cell (in a random order)
+        pt_order = rng.permutation(pt_num)
+        pt_order = pt_order[np.argsort(cell_id[pt_order], kind="stable")]
+        cell_st = np.flatnonzero(np.r_[True, np.diff(cell_id[pt_order]) != 0])
+        pt_rank = np.arange(pt_num) - np.repeat(cell_st, np.diff(np.r_[cell_st, pt_num]))
+        # round robin over the cells (in a random order): the 1st point of each cell, then the 2nd, ...
+        return pt_order[np.lexsort((rng.random(pt_num), pt_rank))][:sample_num]
+    elif sample_mode == "fps":
+        idx = np.empty(sample_num, dtype=int)
+        idx[0] = rng.integers(pt_num)
+        min_dist2 = np.sum((pts - pts[idx[0]]) ** 2, axis=1)
+        for i in range(1, sample_num):
+            idx[i] = np.argmax(min_dist2)
+            min_dist2 = np.minimum(min_dist2, np.sum((pts - pts[idx[i]]) ** 2, axis=1))
+        return idx
+    else:
+        raise ValueError(f"The expected 'sample_mode' is in ['random', 'stratified', 'fps'], "
+                         f"but {sample_mode} was gotten.")
+
+def get_autooptim_bf_radius_GU(pts, down_sample_num=400, is_down=True, isDebug=False, ph_backend="alpha",
+                               bfr_num=100, is_exact=False, sample_mode="random", seed=None, is_adaptive=False,
+                               sample_num_init=100, sample_tole=0.05, stable_steps=2, return_sample_num=False):
+    # down_sample_num: the number of sampled points (is_down), all points if there are fewer
+    # sample_mode:     see get_sample_idx(). "random" without seed: np.random.choice as before
+    # seed:            the seed of the sampling, for repeatable runs
+    # is_adaptive:     (is_down only) the sample grows from sample_num_init points (x2 per step) until bfr_optim
+    #                  changes by <= sample_tole (relative) in stable_steps successive steps, or all points are used.
+    #                  The stability is tested on the exact radius, as bfr_1d (is_exact=False) changes with the sample.
+    #                  down_sample_num is not used.
+    # return_sample_num: whether to return the number of points used
+    pt_num = pts.shape[0]
+    if not is_down:
+        sample_nums = [pt_num]
+    elif not is_adaptive:
+        sample_nums = [min(down_sample_num, pt_num)]
     else:
-        pts_down = pts
+        sample_nums = [min(sample_num_init * 2 ** i, pt_num)
+                       for i in range(int(np.ceil(np.log2(max(pt_num / sample_num_init, 1)))) + 1)]
+
+    bfr_res, bfr_exact, stable_num = None, None, 0
+    for sample_num in sample_nums:
+        if is_down and sample_mode == "random" and seed is None and not is_adaptive:
+            pts_down = pts[np.random.choice(pt_num, sample_num, replace=False)]
+        elif sample_num == pt_num:
+            pts_down = pts
+        else:
+            pts_down = pts[get_sample_idx(pts, sample_num, sample_mode, seed)]
+
+        *bfr_res_new, bfr_exact_new = calc_bf_radius_GU(pts_down, isDebug, ph_backend, bfr_num, is_exact,
+                                                        return_exact=True)
+        is_stable = bfr_exact is not None and abs(bfr_exact_new - bfr_exact) <= sample_tole * abs(bfr_exact_new)
+        stable_num = stable_num + 1 if is_stable else 0
+        bfr_res, bfr_exact = tuple(bfr_res_new), bfr_exact_new
+        if stable_num >= stable_steps:
+            break
 
+    if isDebug:
+        print(f"[1-get_basic_ol/get_optim_bf_radius()] :: sample_num={sample_num} of {pt_num} points")
+
+    if return_sample_num:
+        return (*bfr_res, sample_num)
+    return bfr_res
+
+def calc_bf_radius_GU(pts_down, isDebug=False, ph_backend="alpha", bfr_num=100, is_exact=False, return_exact=False):
+    # ph_backend: "alpha": gudhi's alpha complex; "mst": get_pers_0d_mst(), the same result in near-linear time,
+    #             fast enough to use all points (is_down=False) instead of down_sample_num random points
+    # bfr_num:    the number of radii of the Betti-0 curve (bfr_1d)
+    # is_exact:   True: bfr_optim is the exact radius where the number of components drops to one,
+    #             False: the first radius of bfr_1d with one component
+    # return_exact: whether to also return the exact radius, whatever is_exact is
     max_dist = np.max(np.linalg.norm(pts_down - np.mean(pts_down, axis=0), axis=1))
 
     # Calculate bfr_0d
     bfr_0d = np.linspace(0, max_dist, num=100)
 
-    # Calculate persistent homology
-    alpha_complex = gd.AlphaComplex(points=pts_down)
-    simplex_tree = alpha_complex.create_simplex_tree()
-    pers_0d = simplex_tree.persistence()
+    # Calculate 0-d persistent homology
+    if ph_backend == "alpha":
+        pers_0d = get_pers_0d_alpha(pts_down)
+    elif ph_backend == "mst":
+        pers_0d = get_pers_0d_mst(pts_down)
+    else:
+        raise ValueError(f"The expected 'ph_backend' is in ['alpha', 'mst'], but {ph_backend} was gotten.")
 
     if isDebug:
         print(f"[1-get_basic_ol/get_optim_bf_radius()] :: calc_PH_0d :: bfr_0d={bfr_0d}, pers_0d=\n{pers_0d}")
 
-    pers_0d = [p for p in pers_0d if p[0] == 0]
-    pers_0d = np.array([p[1] for p in pers_0d])
-
-    pers_len_0d = pers_0d[:, 1] - pers_0d[:, 0]
+    # Betti-0 curve: the number of components alive at r, i.e. #(death > r) - #(birth > r)
+    births, deaths = np.sort(pers_0d[:, 0]), np.sort(pers_0d[:, 1])
+    get_betti_0d = lambda r: (len(deaths) - np.searchsorted(deaths, r, side="right")) - \
+                             (len(births) - np.searchsorted(births, r, side="right"))
 
-    sorted_indices = np.argsort(pers_len_0d)[::-1]
-    pers_0d_sorted = pers_0d[sorted_indices]
-    pers_len_0d_sorted = pers_len_0d[sorted_indices]
+    bfr_1d = np.linspace(0, max_dist, num=bfr_num)
+    pers_1d = get_betti_0d(bfr_1d).astype(bfr_1d.dtype)
 
-    bfr_1d = np.linspace(0, max_dist, num=100)
-    pers_1d = np.zeros_like(bfr_1d)
+    # the exact radius where the number of components drops to one: the curve only changes at births / deaths
+    bfr_events = np.unique(np.concatenate([births, deaths[np.isfinite(deaths)]]))
+    bfr_exact = bfr_events[np.argmax(get_betti_0d(bfr_events) == 1)]
 
-    for i, r in enumerate(bfr_1d):
-        pers_1d[i] = np.sum(pers_0d_sorted[:, 1] > r) - np.sum(pers_0d_sorted[:, 0] > r)
-
-    bfr_optim = bfr_1d[np.where(pers_1d == 1)[0][0]]
+    if is_exact:
+        bfr_optim = bfr_exact
+    else:
+        # the first radius of bfr_1d with one component, bfr_exact if it is beyond bfr_1d
+        bfr_idx = np.flatnonzero(pers_1d == 1)
+        bfr_optim = bfr_1d[bfr_idx[0]] if len(bfr_idx) > 0 else bfr_exact
 
     if isDebug:
         print(f"[1-get_basic_ol/get_optim_bf_radius()] :: bfr_optim={bfr_optim}")
 
+    if return_exact:
+        return bfr_optim, bfr_0d, bfr_1d, pers_1d, bfr_exact
     return bfr_optim, bfr_0d, bfr_1d, pers_1d
 
 def get_build_bf(pts, bfr_optim, bf_tole=5e-1, bf_otdiff=1e-2, isDebug=False):
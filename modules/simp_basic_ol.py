@@ -7,12 +7,87 @@
 simplify basic building outlines
 """
 
+import copy
+import json
+import time
+import hashlib
+import traceback
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from itertools import repeat
+
 import numpy as np
 import shapely
 from shapely.geometry import Polygon
 
-from utils.mdl_FD import get_fd, trunc_fft, recon_by_fdLow
-from utils.mdl_geo import get_PolygonCoords_withInter, arr2Geo
+from utils.mdl_FD import get_fd, trunc_fft, recon_by_fdLow, recon_by_fd_batch
+from utils.mdl_geo import get_PolygonCoords_withInter, arr2Geo, get_ring_segs, is_hausdorff_within, get_hausdorff
+from utils.mdl_geo import polys2Arrs, arrs2Polys
+from utils.mdl_io import DiskCache
+
+
+class SimpBudget:
+    """
+    the time / evaluation budget of simplifying a building, shared by all its sub-polys
+    :param time_budget: the max. time (seconds) from now, None: no limit
+    :param eval_budget: the max. number of evaluated simplified polys, None: no limit
+    """
+    def __init__(self, time_budget:float=None, eval_budget:int=None):
+        self.deadline = None if time_budget is None else time.perf_counter() + time_budget
+        self.eval_left = eval_budget
+        self.is_hit = False # whether some evaluations were refused
+
+    def take(self, eval_num:int=1) -> int:
+        """
+        ask for evaluating eval_num simplified polys
+        :param eval_num: the number of evaluations
+        :return:
+            the number of evaluations allowed, < eval_num if the budget is hit
+        """
+        eval_allowed = eval_num
+        if self.deadline is not None and time.perf_counter() >= self.deadline:
+            eval_allowed = 0
+        if self.eval_left is not None:
+            eval_allowed = min(eval_allowed, self.eval_left)
+            self.eval_left -= eval_allowed
+        if eval_allowed < eval_num:
+            self.is_hit = True
+        return eval_allowed
+
+
+def get_iou_batch(polys_simp:np.ndarray or list, poly_used_geo:shapely.geometry) -> np.ndarray:
+    """
+    the IoU between several simplified polys and the same original poly, with one overlay per simplified poly:
+    union's area = area(simp) + area(used) - intersection's area.
+    The original poly is prepared once, the simplified polys inside it or disjoint with it need no overlay.
+    Invalid simplified polys are overlaid by intersection and union as before.
+    :param polys_simp:    shape=(B, ), the simplified Polygons
+    :param poly_used_geo: the original Polygon
+    :return:
+        iou:              shape=(B, ), 0 if the overlay failed
+    """
+    polys_simp = np.asarray(polys_simp, dtype=object)
+    shapely.prepare(poly_used_geo)
+    simp_area = shapely.area(polys_simp)
+    used_area = poly_used_geo.area
+
+    iou = np.zeros(polys_simp.shape[0])
+    is_valid = shapely.is_valid(polys_simp)
+    # valid & inside the original poly: the intersection is the simplified poly
+    is_inside = is_valid & shapely.contains_properly(poly_used_geo, polys_simp)
+    iou[is_inside] = simp_area[is_inside] / used_area
+    # valid & overlapping: one overlay, the disjoint ones keep 0
+    is_overlay = is_valid & ~is_inside & shapely.intersects(poly_used_geo, polys_simp)
+    inter_area = shapely.area(shapely.intersection(polys_simp[is_overlay], poly_used_geo))
+    iou[is_overlay] = inter_area / (simp_area[is_overlay] + used_area - inter_area)
+
+    # invalid: the area formula does not hold, overlay both as before (0 if the overlay fails)
+    for pi in np.flatnonzero(~is_valid):
+        try:
+            iou[pi] = polys_simp[pi].intersection(poly_used_geo).area / polys_simp[pi].union(poly_used_geo).area
+        except shapely.errors.GEOSException:
+            iou[pi] = 0
+    return iou
 
 
 def stop_by_IoU(poly_simp: np.ndarray, poly_used_geo:shapely.geometry):
@@ -21,17 +96,11 @@ def stop_by_IoU(poly_simp: np.ndarray, poly_used_geo:shapely.geometry):
             poly_used_fdRi_geo = arr2Geo(poly_simp, "poly").run()
         else:
             poly_used_fdRi_geo = poly_simp
-        inter_simp_used = poly_used_fdRi_geo.intersection(poly_used_geo)
-        union_simp_used = poly_used_fdRi_geo.union(poly_used_geo)
-    except:
-        inter_simp_used = None
-        union_simp_used = None
-
-    if inter_simp_used is not None:
-        RO_area_inter = inter_simp_used.area / union_simp_used.area
-    else:
-        RO_area_inter = 0
+    except ValueError:
+        # poly_simp can not be a polygon
+        return 0
 
+    RO_area_inter = get_iou_batch([poly_used_fdRi_geo], poly_used_geo)[0]
     return RO_area_inter
 
 
@@ -39,16 +108,322 @@ def stop_by_Hausdoff(poly_simp: np.ndarray, poly_used_geo: shapely.geometry):
     try:
         poly_used_fdRi_geo = arr2Geo(poly_simp, "poly").run()
         hausd = poly_used_geo.hausdorff_distance(poly_used_fdRi_geo)
-    except:
-        hausd = 10
+    except (ValueError, shapely.errors.GEOSException):
+        # poly_simp can not be a polygon, never meets any threshold
+        hausd = np.inf
 
     return hausd
 
+def judge_simp_batch(simp_coords:np.ndarray, simp_offsets:np.ndarray, poly_used_geo:shapely.geometry,
+                     thres_mode:str, thres_simparea:float, thres_haus:float, ref_segs:tuple=None) -> np.ndarray:
+    """
+    judge whether several simplified polys meet the threshold, the same judgement as in get_proper_simp_res()
+    :param simp_coords:    shape=[n, 2], the pts of all simplified polys, concatenated
+    :param simp_offsets:   shape=(B+1, ), simp_coords[simp_offsets[b]:simp_offsets[b+1]] is the b-th simplified poly
+    :param poly_used_geo:  the Polygon of poly_used
+    :param thres_mode:     the thres mode. ["haus"(hausdorff distance), "iou"]
+    :param thres_simparea: the iou threshold
+    :param thres_haus:     hausdorff threshold
+    :param ref_segs:       the segments of poly_used_geo's exterior by get_ring_segs(), reused by the "haus" mode.
+                           None: computed here
+    :return:
+        is_sele:           shape=(B, ), bool, whether each simplified poly meets the threshold
+    """
+    simp_ranges = list(zip(simp_offsets[:-1], simp_offsets[1:]))
+    if thres_mode == "haus":
+        if ref_segs is None:
+            ref_segs = get_ring_segs(np.asarray(poly_used_geo.exterior.coords))
+        return np.array([is_hausdorff_within(simp_coords[st:ed], ref_segs, thres_haus) for st, ed in simp_ranges],
+                        dtype=bool)
+
+    simp_idx = np.repeat(np.arange(len(simp_ranges)), np.diff(simp_offsets))
+    simp_geos = shapely.polygons(shapely.linearrings(simp_coords, indices=simp_idx))
+    return get_iou_batch(simp_geos, poly_used_geo) >= thres_simparea
+
+
+def resample_ring_by_arclen(ring_arr:np.ndarray, pt_num:int) -> np.ndarray:
+    """
+    resample a ring uniformly along its arc length
+    :param ring_arr: shape=[K, 2], the pts of the ring, closed or not
+    :param pt_num:   the number of pts after resampling
+    :return:
+        ring_rs:     shape=[pt_num, 2], the resampled ring (not closed), starting at the first pt of ring_arr
+    """
+    ring_arr = np.asarray(ring_arr, dtype=float)
+    if not np.array_equal(ring_arr[0], ring_arr[-1]):
+        ring_arr = np.vstack((ring_arr, ring_arr[:1]))
+    arc_len = np.concatenate(([0], np.cumsum(np.linalg.norm(np.diff(ring_arr, axis=0), axis=1))))
+    arc_len_rs = np.arange(pt_num) * (arc_len[-1] / pt_num)
+    return np.stack((np.interp(arc_len_rs, arc_len, ring_arr[:, 0]),
+                     np.interp(arc_len_rs, arc_len, ring_arr[:, 1])), axis=-1)
+
+
+def get_resampled_ring(ring_arr:np.ndarray, resample_tole:float=0.5, resample_factor:int=4) -> np.ndarray:
+    """
+    resample a ring uniformly along its arc length before FD, to reduce the FFT size and the truncation levels to search.
+    The number of pts is a power of two, starting from resample_factor * the vertex number of the ring simplified by
+    Douglas-Peucker (resample_tole), and doubled until the resampled ring's hausdorff distance to the ring
+    <= resample_tole. If no fewer pts meets it, the ring is not resampled.
+    :param ring_arr:        shape=[K, 2], the pts of the ring
+    :param resample_tole:   the tolerance of Douglas-Peucker, and the max. hausdorff distance of the resampled ring,
+                            in map units (find_contours() gives a vertex every half pixel)
+    :param resample_factor: the number of pts per vertex of the simplified ring
+    :return:
+        ring_rs:            the resampled ring, or ring_arr if it is not resampled
+    """
+    ring_arr = np.asarray(ring_arr, dtype=float)
+    ring_vnum = ring_arr.shape[0] - int(np.array_equal(ring_arr[0], ring_arr[-1]))
+
+    simp_vnum = len(shapely.simplify(shapely.linearrings(ring_arr), resample_tole).coords) - 1
+    pt_num = 2 ** int(np.ceil(np.log2(max(resample_factor * simp_vnum, 4))))
+    ring_segs = get_ring_segs(ring_arr)
+    while pt_num < ring_vnum:
+        ring_rs = resample_ring_by_arclen(ring_arr, pt_num)
+        if is_hausdorff_within(ring_rs, ring_segs, resample_tole):
+            return ring_rs
+        pt_num *= 2
+    return ring_arr
+
+
+def get_resample_tole(resample_tole:float, resample_haus_ratio:float, thres_mode:str, thres_haus:float) -> float:
+    """
+    the tolerance used by get_resampled_ring(): with thres_mode="haus", the resampling error is clamped to a fraction
+    of thres_haus, otherwise it uses up the threshold before any FD level is truncated
+    :param resample_tole:       the given tolerance
+    :param resample_haus_ratio: the max. ratio of the tolerance to thres_haus
+    :param thres_mode:          "haus" or "iou"
+    :param thres_haus:          the threshold of hausdorff distance
+    :return:
+        resample_tole:          the tolerance used
+    """
+    if thres_mode == "haus":
+        return min(resample_tole, resample_haus_ratio * thres_haus)
+    return resample_tole
+
+
+def get_proper_simp_res_batch(poly_used:np.ndarray,
+                              poly_used_geo:shapely.geometry,
+                              thres_mode:str,
+                              thres_simparea:float,
+                              thres_haus:float,
+                              batch_size:int=16,
+                              budget:SimpBudget=None) -> list:
+    """
+    the batched version of get_proper_simp_res(), with the same result.
+    The FD is shifted once, and the truncation levels are rebuilt and evaluated in bulk batch by batch.
+    Levels 2k and 2k+1 give the same simplified poly, so it is rebuilt and evaluated only once.
+    :param batch_size:          the number of truncation levels per batch
+    other params and return:    see get_proper_simp_res()
+    """
+    if thres_mode not in ["haus", "iou"]:
+        raise ValueError(f"The expected 'thres_mode' is in ['haus', 'iou'], but {thres_mode} was gotten.")
+
+    # get the max_num for simplifying
+    poly_vnum = poly_used.shape[0]
+
+    #########################
+    # 3.1 preparation of Fourier descriptor
+    #########################
+    poly_min = np.min(poly_used, axis=0)
+    poly_used = poly_used - poly_min
+    poly_scale = np.max(poly_used)
+
+    #########################
+    # 3.2 get Fourier descriptor of the shape, shifted once for all truncation levels
+    #########################
+    poly_fd_shift = np.fft.fftshift(get_fd(poly_used))
+    ref_segs = get_ring_segs(np.asarray(poly_used_geo.exterior.coords)) if thres_mode == "haus" else None
+
+    #########################
+    # 3.3 rebuild & judge the truncation levels batch by batch
+    #########################
+    poly_simp_sele_list = []
+    level_st = 3
+    while level_st < poly_vnum:
+        levels = np.arange(level_st, min(level_st + batch_size, int(poly_vnum)))
+        # level 2k and 2k+1 keep the same FD, so each distinct simplified poly is rebuilt & evaluated once
+        halfs, level_inv = np.unique(levels // 2, return_inverse=True)
+        is_eval = 2 * halfs >= 3 # 有三个以上的点
+        if budget is not None:
+            # only the levels whose simplified polys can be evaluated within the budget
+            eval_allowed = budget.take(int(is_eval.sum()))
+            if eval_allowed == 0:
+                break
+            if eval_allowed < is_eval.sum():
+                half_num = int(np.searchsorted(np.cumsum(is_eval), eval_allowed, side="right"))
+                levels, level_inv = levels[level_inv < half_num], level_inv[level_inv < half_num]
+                halfs, is_eval = halfs[:half_num], is_eval[:half_num]
+        simp_coords, simp_offsets = recon_by_fd_batch(poly_fd_shift, 2 * halfs[is_eval], scale=poly_scale)
+        # re-normalize
+        simp_coords += poly_min
+
+        is_sele = np.zeros(len(halfs), dtype=bool)
+        is_sele[is_eval] = judge_simp_batch(simp_coords, simp_offsets, poly_used_geo,
+                                            thres_mode, thres_simparea, thres_haus, ref_segs)
+        simp_offsets = dict(zip(np.flatnonzero(is_eval), zip(simp_offsets[:-1], simp_offsets[1:])))
+
+        for level, hi in zip(levels, level_inv):
+            if is_sele[hi]:
+                st, ed = simp_offsets[hi]
+                poly_simp_sele_list.append([int(level), simp_coords[st:ed].copy()])
+            # when the simplification result is stable, stop and output
+            if len(poly_simp_sele_list) > 2:
+                return poly_simp_sele_list
+
+        if budget is not None and budget.is_hit:
+            break
+        level_st = int(levels[-1]) + 1
+
+    return poly_simp_sele_list
+
+
+def get_proper_simp_res_bisect(poly_used:np.ndarray,
+                               poly_used_geo:shapely.geometry,
+                               thres_mode:str,
+                               thres_simparea:float,
+                               thres_haus:float,
+                               budget:SimpBudget=None,
+                               scan_window:int=16) -> list:
+    """
+    the search version of get_proper_simp_res(), with a (nearly) logarithmic number of evaluations.
+    A level meeting the threshold is found by an exponential probe, or by a grid of about scan_window levels if the
+    probe finds none, followed by bisection. The acceptance is not monotone, so the levels below it are re-probed on
+    the grid, and scanned downward from the lowest accepted one until scan_window successive levels are rejected.
+    Then the stability (>2 levels meet the threshold) is verified by scanning upward from this level.
+    If neither the probe nor the grid finds a level meeting the threshold, the levels are scanned linearly by
+    get_proper_simp_res_batch(), so the result is empty only if it is empty for the linear scan (or the budget is hit).
+    A level meeting the threshold which is isolated among rejected ones can be missed, then the first level of the
+    result is larger (more vertices) than the one of the linear scan.
+    :param scan_window: the number of grid levels and the window of the downward scan, larger: closer to the linear scan
+    other params and return:    see get_proper_simp_res()
+    """
+    if thres_mode not in ["haus", "iou"]:
+        raise ValueError(f"The expected 'thres_mode' is in ['haus', 'iou'], but {thres_mode} was gotten.")
+
+    # get the max_num for simplifying
+    poly_vnum = int(poly_used.shape[0])
+
+    #########################
+    # 3.1 preparation of Fourier descriptor
+    #########################
+    poly_min = np.min(poly_used, axis=0)
+    poly_used_norm = poly_used - poly_min
+    poly_scale = np.max(poly_used_norm)
+
+    #########################
+    # 3.2 get Fourier descriptor of the shape, shifted once for all truncation levels
+    #########################
+    poly_fd_shift = np.fft.fftshift(get_fd(poly_used_norm))
+    ref_segs = get_ring_segs(np.asarray(poly_used_geo.exterior.coords)) if thres_mode == "haus" else None
+
+    #########################
+    # 3.3 search the truncation levels.
+    # level 2k and 2k+1 keep the same FD, so the search is on k (half of the level)
+    #########################
+    half_results = {}
+    def eval_half(half):
+        # None if the budget is hit
+        if half not in half_results:
+            if budget is not None and budget.take() == 0:
+                return None
+            poly_simp, simp_offsets = recon_by_fd_batch(poly_fd_shift, [2 * half], scale=poly_scale)
+            # re-normalize
+            poly_simp += poly_min
+            is_sele = judge_simp_batch(poly_simp, simp_offsets, poly_used_geo,
+                                       thres_mode, thres_simparea, thres_haus, ref_segs)[0]
+            half_results[half] = (is_sele, poly_simp)
+        return half_results[half]
+
+    # level 3 (2 pts) can not be a poly, so half=2 is the first one to evaluate
+    half_min, half_max = 2, (poly_vnum - 1) // 2
+    if half_max < half_min:
+        return []
+
+    # 3.3.1 exponential probe: the first half in [2, 4, 8, ..., half_max] meeting the threshold
+    half_lo, half_hi = half_min - 1, half_min
+    while True:
+        half_res = eval_half(half_hi)
+        if half_res is None:
+            return []
+        if half_res[0]:
+            break
+        if half_hi == half_max:
+            half_hi = None
+            break
+        half_lo, half_hi = half_hi, min(2 * half_hi, half_max)
+
+    # no half of the probe meets the threshold: probe a grid of about scan_window halves, from small to large,
+    # or scan linearly if none of them meets it either
+    if half_hi is None:
+        half_stride = max(1, -(-(half_max - half_min) // scan_window))
+        half_lo = half_min - 1
+        for half in range(half_min, half_max, half_stride):
+            half_res = eval_half(half)
+            if half_res is None:
+                return []
+            if half_res[0]:
+                half_hi = half
+                break
+            half_lo = half
+        if half_hi is None:
+            return get_proper_simp_res_batch(poly_used, poly_used_geo, thres_mode, thres_simparea,
+                                             thres_haus, budget=budget)
+
+    # 3.3.2 bisection in (half_lo, half_hi]
+    while half_hi - half_lo > 1:
+        half_mid = (half_lo + half_hi) // 2
+        half_res = eval_half(half_mid)
+        if half_res is None:
+            break
+        if half_res[0]:
+            half_hi = half_mid
+        else:
+            half_lo = half_mid
+
+    # 3.3.3 the acceptance is not monotone, halves below half_hi may meet the threshold, too:
+    # re-probe [half_min, half_hi) on a grid of about scan_window halves, from small to large,
+    # then scan downward from the first accepted one until scan_window successive halves are rejected
+    half_stride = max(1, -(-(half_hi - half_min) // scan_window))
+    for half in range(half_min, half_hi, half_stride):
+        half_res = eval_half(half)
+        if half_res is None:
+            break
+        if half_res[0]:
+            half_hi = half
+            break
+    half, rejected_num = half_hi - 1, 0
+    while half >= half_min and rejected_num < scan_window:
+        half_res = eval_half(half)
+        if half_res is None:
+            break
+        if half_res[0]:
+            half_hi, rejected_num = half, 0
+        else:
+            rejected_num += 1
+        half -= 1
+
+    # 3.3.4 verify the stability locally: scan upward from the first level meeting the threshold
+    poly_simp_sele_list = []
+    for i in range(max(2 * half_hi, 3), poly_vnum):
+        half_res = eval_half(i // 2)
+        if half_res is None:
+            break
+        if half_res[0]:
+            poly_simp_sele_list.append([i, half_res[1].copy()])
+        # when the simplification result is stable, stop and output
+        if len(poly_simp_sele_list) > 2:
+            break
+
+    return poly_simp_sele_list
+
+
 def get_proper_simp_res(poly_used:np.ndarray,
                         poly_used_geo:shapely.geometry,
                         thres_mode:str,
                         thres_simparea:float,
-                        thres_haus:float) -> list:
+                        thres_haus:float,
+                        fd_engine:str="loop",
+                        budget:SimpBudget=None) -> list:
     """
     for a polygon, save its 3 simplified poly whose area / original poly's area >= thres_simparea
     :param poly_used:           the pts of poly_used
@@ -56,10 +431,22 @@ def get_proper_simp_res(poly_used:np.ndarray,
     :param thres_mode:          the thres mode. ["haus"(hausdorff distance), "iou"]
     :param thres_simparea:      the threshold to determine whether a simplified poly can be saved
     :param thres_haus:          hausdorff threshold
+    :param fd_engine:           ["loop"(one truncation level per iteration), "batch"(get_proper_simp_res_batch()),
+                                 "bisect"(get_proper_simp_res_bisect())]
+    :param budget:              the budget of evaluations, the search stops when it is hit. None: no limit
     :return:
         poly_simp_sele_list:    top-3 simplified polys meeting the threshold requirement.
                                 Why top-3? ensure the poly meeting the threshold is not a random result
     """
+    if fd_engine == "batch":
+        return get_proper_simp_res_batch(poly_used, poly_used_geo, thres_mode, thres_simparea, thres_haus,
+                                         budget=budget)
+    elif fd_engine == "bisect":
+        return get_proper_simp_res_bisect(poly_used, poly_used_geo, thres_mode, thres_simparea, thres_haus,
+                                          budget=budget)
+    elif fd_engine != "loop":
+        raise ValueError(f"The expected 'fd_engine' is in ['loop', 'batch', 'bisect'], but {fd_engine} was gotten.")
+
     # get the max_num for simplifying
     poly_vnum = poly_used.shape[0]
 
@@ -69,6 +456,8 @@ def get_proper_simp_res(poly_used:np.ndarray,
     #########################
     # if shape_pts[:,0].min != 0: # 该数据没有经过归一化
     poly_min = np.min(poly_used, axis=0)
+    # the segments of the original poly, reused by the hausdorff judgement of all simplified polys
+    ref_segs = get_ring_segs(np.asarray(poly_used_geo.exterior.coords)) if thres_mode == "haus" else None
     poly_used = poly_used - poly_min
 
     #########################
@@ -94,13 +483,14 @@ def get_proper_simp_res(poly_used:np.ndarray,
 
         # 3.3.3 judge whether the iteration stop or not
         if poly_simp.shape[0] >= 3: # 有三个以上的点
+            if budget is not None and budget.take() == 0:
+                break
             if thres_mode=="iou":
                 value_of_thres = stop_by_IoU(poly_simp, poly_used_geo)
                 if value_of_thres >= thres_simparea:
                     poly_simp_sele_list.append([num_sele_fd, poly_simp])
             elif thres_mode=="haus":
-                value_of_thres = stop_by_Hausdoff(poly_simp, poly_used_geo)
-                if value_of_thres <= thres_haus:
+                if is_hausdorff_within(poly_simp, ref_segs, thres_haus):
                     poly_simp_sele_list.append([num_sele_fd, poly_simp])
             else:
                 raise ValueError(f"The expected 'thres_mode' is in ['haus', 'iou'], but {thres_mode} was gotten.")
@@ -115,7 +505,16 @@ def simp_poly_Fd(poly:shapely.geometry,
                  thres_mode:str="haus",
                  thres_simparea:float=0.99,
                  thres_haus:float=0.5,
-                 isDebug:bool=False) -> (np.ndarray or list, list, Polygon):
+                 isDebug:bool=False,
+                 fd_engine:str="loop",
+                 is_resample:bool=False,
+                 resample_tole:float=0.5,
+                 resample_factor:int=4,
+                 resample_haus_ratio:float=0.25,
+                 time_budget:float=None,
+                 eval_budget:int=None,
+                 fallback_tole:float=None,
+                 return_converged:bool=False) -> (np.ndarray or list, list, Polygon):
     """
     simplify the polygon by Fourier descriptor
     :param poly:            the Polygon
@@ -129,10 +528,31 @@ def simp_poly_Fd(poly:shapely.geometry,
                                 THIS simplified poly can be saved as a candidate result
     :param thres_haus:      The hausdorff_distance threshold between poly_simp and poly_used_geon, adaptive.
     :param isDebug:
+    :param fd_engine:       ["loop", "batch", "bisect"], see get_proper_simp_res()
+    :param is_resample:     whether to resample each sub-poly along its arc length before FD.
+                            The simplified polys are still judged against the original sub-poly.
+    :param resample_tole:   see get_resampled_ring(). With thres_mode="haus", it is clamped to
+                            resample_haus_ratio * thres_haus, so that the resampling error leaves room for the FD levels.
+                            If no FD level of the resampled sub-poly meets the threshold, the sub-poly is not resampled.
+    :param resample_factor: see get_resampled_ring()
+    :param resample_haus_ratio: see resample_tole
+    :param time_budget:     the max. time (seconds) of simplifying the polygon, None: no limit
+    :param eval_budget:     the max. number of simplified polys evaluated for the polygon, None: no limit.
+                            When the budget is hit, a sub-poly uses the first simplified poly meeting the threshold
+                            found so far. If there is not, or if no simplified poly meets the threshold at all
+                            (with a budget given), it uses its Douglas-Peucker simplification (tolerance = fallback_tole).
+    :param fallback_tole:   the tolerance of the Douglas-Peucker fallback. None: thres_haus with thres_mode="haus";
+                            with thres_mode="iou", (1 - thres_simparea) * area / perimeter of the sub-poly, i.e. the
+                            width of a band along the boundary whose area is the allowed area difference
+    :param return_converged: whether to return is_converged
     :return:
         poly_ext_simp, poly_ints_simp: the simplified poly_arr of exterior and interiors
         poly_simp_geo:                 the shapely.geometry.Polygon object of the simplified result
+        is_converged:                  (only if return_converged) False if the budget was hit or a sub-poly uses the
+                                       Douglas-Peucker fallback
     """
+    budget = SimpBudget(time_budget, eval_budget) if time_budget is not None or eval_budget is not None else None
+
     ####################
     # 1. Get coords arrs of all exterior and interior polys
     ####################
@@ -148,6 +568,7 @@ def simp_poly_Fd(poly:shapely.geometry,
     # calculate their Fourier descriptor with different simplify param.
     ####################
     poly_ext_simp, poly_ints_simp = [], []
+    is_converged = True
     for pi in range(1 + len(poly_ints)):
         # choose the polygon need to be calculated
         if pi == 0:  # when pi=0, calculate input_poly's exterior's poly
@@ -168,13 +589,31 @@ def simp_poly_Fd(poly:shapely.geometry,
             poly_used.shape) == 2, f"The shape of used polygon which will be simplified by Fourier descriptor " \
                                    f"is {poly_used.shape}," \
                                    f"but a 2d array is expected."
-
+        poly_used_rs = poly_used
+        if is_resample:
+            poly_used_rs = get_resampled_ring(poly_used, get_resample_tole(resample_tole, resample_haus_ratio,
+                                                                           thres_mode, thres_haus), resample_factor)
 
         #########################
         # 3.1-3.3 get Fourier descriptor of each poly_used, and save several proper simplified result (3 polys),
         # the end of iteration depends on the thres_mode
         #########################
-        poly_simp_sele_list = get_proper_simp_res(poly_used, poly_used_geo, thres_mode, thres_simparea, thres_haus)
+        poly_simp_sele_list = get_proper_simp_res(poly_used_rs, poly_used_geo, thres_mode, thres_simparea, thres_haus,
+                                                  fd_engine=fd_engine, budget=budget)
+        if len(poly_simp_sele_list) == 0 and poly_used_rs is not poly_used and (budget is None or not budget.is_hit):
+            # no FD level of the resampled sub-poly meets the threshold: the original one
+            poly_simp_sele_list = get_proper_simp_res(poly_used, poly_used_geo, thres_mode, thres_simparea,
+                                                      thres_haus, fd_engine=fd_engine, budget=budget)
+        if len(poly_simp_sele_list) == 0 and budget is not None:
+            # out of budget, or no simplified poly meets the threshold: Douglas-Peucker simplification instead
+            if fallback_tole is not None:
+                simp_tole = fallback_tole
+            elif thres_mode == "haus":
+                simp_tole = thres_haus
+            else:
+                simp_tole = (1 - thres_simparea) * poly_used_geo.area / poly_used_geo.length
+            poly_simp_sele_list = [[-1, np.asarray(poly_used_geo.simplify(simp_tole).exterior.coords)]]
+            is_converged = False
 
         #########################
         # 3.4 get final simplified result for each poly used: by using the first poly can meed the threshold in 3.1-3.3
@@ -204,74 +643,464 @@ def simp_poly_Fd(poly:shapely.geometry,
     ####################
     # 5. Return result
     ####################
+    if return_converged:
+        return poly_ext_simp, poly_ints_simp, poly_simp_geo, is_converged and (budget is None or not budget.is_hit)
     return poly_ext_simp, poly_ints_simp, poly_simp_geo
 
 
 
-def simp_poly_Extmtd(poly:shapely.geometry, bfr_otdiff:float, bfr_tole:float) -> \
-        (np.ndarray or list, list, shapely.geometry):
+def get_fd_err_curve(poly_used:np.ndarray,
+                     poly_used_geo:shapely.geometry,
+                     thres_mode:str,
+                     thres_list:list=None,
+                     batch_size:int=16) -> (np.ndarray, np.ndarray, list):
     """
-    simple polygon by using exsiting methods in shapely library
-    :param poly:
+    get the error (hausdorff distance or iou) between the original poly and its FD-simplified polys of
+    all truncation levels, from the fewest vertices on. The FD is computed and shifted once.
+    :param poly_used:     the pts of poly_used
+    :param poly_used_geo: the Polygon of poly_used
+    :param thres_mode:    the thres mode. ["haus"(hausdorff distance), "iou"]
+    :param thres_list:    the thresholds. If given, stop when the first simplified poly meeting each threshold is found.
+                          None: the errors of all truncation levels
+    :param batch_size:    the number of truncation levels rebuilt and evaluated at once
+    :return:
+        simp_vnums:       shape=(L, ), the vertex number of each simplified poly, = the truncation level 2k (and 2k+1)
+        simp_errs:        shape=(L, ), the error of each simplified poly
+        simp_polys:       L * [P, 2], the simplified polys
+    """
+    if thres_mode not in ["haus", "iou"]:
+        raise ValueError(f"The expected 'thres_mode' is in ['haus', 'iou'], but {thres_mode} was gotten.")
+
+    poly_min = np.min(poly_used, axis=0)
+    poly_used = poly_used - poly_min
+    poly_scale = np.max(poly_used)
+    poly_fd_shift = np.fft.fftshift(get_fd(poly_used))
+    ref_segs = get_ring_segs(np.asarray(poly_used_geo.exterior.coords)) if thres_mode == "haus" else None
+
+    # level 2k and 2k+1 keep the same FD, level 3 (2 pts) can not be a poly
+    halfs = np.arange(2, (poly_used.shape[0] - 1) // 2 + 1)
+    thres_left = None if thres_list is None else np.asarray(thres_list, dtype=float)
+    simp_errs, simp_polys = [], []
+    for batch_st in range(0, len(halfs), batch_size):
+        batch_halfs = halfs[batch_st:batch_st + batch_size]
+        simp_coords, simp_offsets = recon_by_fd_batch(poly_fd_shift, 2 * batch_halfs, scale=poly_scale)
+        # re-normalize
+        simp_coords += poly_min
+        batch_polys = np.split(simp_coords, simp_offsets[1:-1])
+
+        if thres_mode == "haus":
+            batch_errs = np.array([get_hausdorff(_, ref_segs) for _ in batch_polys])
+        else:
+            simp_idx = np.repeat(np.arange(len(batch_halfs)), np.diff(simp_offsets))
+            batch_errs = get_iou_batch(shapely.polygons(shapely.linearrings(simp_coords, indices=simp_idx)),
+                                       poly_used_geo)
+        simp_errs.append(batch_errs)
+        simp_polys += batch_polys
+
+        # stop when all the thresholds are met
+        if thres_left is not None:
+            if thres_mode == "haus":
+                thres_left = thres_left[thres_left < batch_errs.min()]
+            else:
+                thres_left = thres_left[thres_left > batch_errs.max()]
+            if len(thres_left) == 0:
+                break
+
+    simp_errs = np.concatenate(simp_errs) if len(simp_errs) > 0 else np.zeros(0)
+    return 2 * halfs[:len(simp_errs)], simp_errs, simp_polys
+
+
+def simp_poly_Fd_sweep(poly:shapely.geometry,
+                       thres_mode:str="haus",
+                       thres_list:list=(0.5,),
+                       is_full_curve:bool=False,
+                       is_resample:bool=False,
+                       resample_tole:float=0.5,
+                       resample_factor:int=4,
+                       resample_haus_ratio:float=0.25) -> (list, list):
+    """
+    simplify the polygon by Fourier descriptor with several thresholds at once,
+    the same results as simp_poly_Fd() with each threshold, but the FD and simplified polys are computed only once
+    :param poly:          the Polygon
+    :param thres_mode:    the thres mode. ["haus"(hausdorff distance), "iou"]
+    :param thres_list:    the thresholds, thres_haus for "haus" and thres_simparea for "iou"
+    :param is_full_curve: whether to get the errors of all truncation levels,
+                          or stop when the first simplified poly meeting each threshold is found
+    :param is_resample, resample_tole, resample_factor, resample_haus_ratio: see simp_poly_Fd(),
+                          with thres_mode="haus", resample_tole is clamped by the smallest threshold
+    :return:
+        simp_res_list:    for each threshold, (poly_ext_simp, poly_ints_simp, poly_simp_geo) as simp_poly_Fd(),
+                          None if a sub-poly can not be simplified with this threshold
+        err_curves:       for the exterior and each interior, {"vertex_num": simp_vnums, "err": simp_errs},
+                          see get_fd_err_curve()
+    """
+    poly_ext, poly_ints = get_PolygonCoords_withInter(poly)
+    poly_ext_geo, poly_ints_geo = poly.exterior, poly.interiors
+
+    thres_list = np.asarray(thres_list, dtype=float)
+    # the selected simplified poly of each sub-poly for each threshold
+    sele_polys = [[] for _ in range(len(thres_list))]
+    err_curves = []
+    for pi in range(1 + len(poly_ints)):
+        if pi == 0:
+            poly_used, poly_used_geo = poly_ext, Polygon(poly_ext_geo)
+        else:
+            poly_used, poly_used_geo = poly_ints[pi - 1], Polygon(poly_ints_geo[pi - 1])
+
+        poly_used = np.asarray(poly_used)
+        poly_used_rs = poly_used
+        if is_resample:
+            poly_used_rs = get_resampled_ring(poly_used, get_resample_tole(resample_tole, resample_haus_ratio,
+                                                                           thres_mode, np.min(thres_list)),
+                                              resample_factor)
+        simp_vnums, simp_errs, simp_polys = get_fd_err_curve(poly_used_rs, poly_used_geo, thres_mode,
+                                                             thres_list=None if is_full_curve else thres_list)
+        is_met = [np.any(simp_errs <= _) if thres_mode == "haus" else np.any(simp_errs >= _) for _ in thres_list]
+        if poly_used_rs is not poly_used and not all(is_met):
+            # some thresholds are not met by the resampled sub-poly: the original one
+            simp_vnums, simp_errs, simp_polys = get_fd_err_curve(poly_used, poly_used_geo, thres_mode,
+                                                                 thres_list=None if is_full_curve else thres_list)
+        err_curves.append({"vertex_num": simp_vnums, "err": simp_errs})
+
+        # the first simplified poly meeting each threshold
+        if thres_mode == "haus":
+            is_sele = simp_errs[None, :] <= thres_list[:, None]
+        else:
+            is_sele = simp_errs[None, :] >= thres_list[:, None]
+        for ti, ti_sele in enumerate(is_sele):
+            sele_polys[ti].append(simp_polys[np.argmax(ti_sele)] if ti_sele.any() else None)
+
+    simp_res_list = []
+    for ti_polys in sele_polys:
+        if any(_ is None for _ in ti_polys):
+            simp_res_list.append(None)
+            continue
+        poly_ext_simp, poly_ints_simp = ti_polys[0], ti_polys[1:]
+        poly_simp_geo = Polygon(poly_ext_simp, holes=poly_ints_simp) if len(poly_ints_simp) != 0 \
+            else Polygon(poly_ext_simp)
+        simp_res_list.append((poly_ext_simp, poly_ints_simp, poly_simp_geo))
+
+    return simp_res_list, err_curves
+
+
+def get_simp_rs(bfr_otdiff:float, bfr_tole:float) -> np.ndarray:
+    """
+    automatic set a series of simplify radius (large->small)
     :param bfr_otdiff: diff value between bfr_optim and bfr_tole(rance)
     :param bfr_tole:   the buffer_radiu_tolerance.
     :return:
-           poly_simp:  the simplified polygon
+           simp_rs:    the simplify radius, descending
     """
-    # automatic set a series of simplify radius
     simp_r_base = bfr_otdiff / 2
     simp_r_max = bfr_tole * 1 / 2  # * np.sqrt(1/2) # simp_r_base * 5
     if simp_r_base != 0:
         if simp_r_max > simp_r_base * 2:
             simp_rs = np.flip(np.arange(simp_r_base * 2, simp_r_max + 0.01, simp_r_base))
         else:
-            simp_rs = [simp_r_max]
+            simp_rs = np.array([simp_r_max])
     else:
         simp_rs = np.flip(np.arange(simp_r_base * 2, simp_r_max + 0.01, 0.05))
+    return simp_rs
+
+
+def simp_poly_Extmtd(poly:shapely.geometry, bfr_otdiff:float, bfr_tole:float, simp_search:str="ladder",
+                     thres_iou:float=0.90, time_budget:float=None, eval_budget:int=None,
+                     return_converged:bool=False) -> (np.ndarray or list, list, shapely.geometry):
+    """
+    simple polygon by using exsiting methods in shapely library
+    :param poly:
+    :param bfr_otdiff:  diff value between bfr_optim and bfr_tole(rance)
+    :param bfr_tole:    the buffer_radiu_tolerance.
+    :param simp_search: how to find the largest simplify radius whose result's iou with poly >= thres_iou.
+                        "ladder": simplify and evaluate the simplify radius in vectorized chunks, large->small.
+                        "bisect": bisection on the simplify radius, assume that the iou decreases with the radius.
+                        If no radius meets thres_iou, the smallest radius is used.
+    :param thres_iou:   the iou threshold
+    :param time_budget: the max. time (seconds), None: no limit
+    :param eval_budget: the max. number of simplified polys to evaluate, None: no limit.
+                        When the budget is hit, the best simplified poly meeting thres_iou found so far is used,
+                        or the smallest radius if there is not.
+    :param return_converged: whether to return is_converged
+    :return:
+           poly_simp:    the simplified polygon
+           is_converged: (only if return_converged) False if the budget was hit
+    """
+    budget = SimpBudget(time_budget, eval_budget) if time_budget is not None or eval_budget is not None else None
+
+    # automatic set a series of simplify radius
+    simp_rs = get_simp_rs(bfr_otdiff, bfr_tole)
 
     # automatic find the proper simplify result by using a series of
     # simplify_radius(large->small, the larger simplify_radius means the more simplified result).
-    for simp_r in simp_rs:
-        # simp_r = 1e-1 *3 # * 2  # 1e-1 is from the buffer tolerance from get_build_bf() -> get_build_bf()
-        poly_simp = poly.simplify(simp_r)
-        iou_simp_org = stop_by_IoU(poly_simp, poly)
-        if iou_simp_org >= 0.90:
-            break
+    poly_simp = None
+    if simp_search == "ladder":
+        # the radius are simplified & evaluated chunk by chunk (chunk size 1, 2, 4, ...),
+        # because the largest radius are the most likely to be chosen
+        chunk_st, chunk_size = 0, 1
+        while chunk_st < len(simp_rs):
+            chunk_rs = simp_rs[chunk_st:chunk_st + chunk_size]
+            if budget is not None:
+                chunk_rs = chunk_rs[:budget.take(len(chunk_rs))]
+                if len(chunk_rs) == 0:
+                    break
+            polys_simp = shapely.simplify(np.full(len(chunk_rs), poly, dtype=object), chunk_rs)
+            is_sele = get_iou_batch(polys_simp, poly) >= thres_iou
+            if is_sele.any():
+                poly_simp = polys_simp[np.argmax(is_sele)]
+                break
+            chunk_st, chunk_size = chunk_st + chunk_size, chunk_size * 2
+    elif simp_search == "bisect":
+        def is_sele(poly_cand):
+            # None if the budget is hit
+            if budget is not None and budget.take() == 0:
+                return None
+            return get_iou_batch([poly_cand], poly)[0] >= thres_iou
+
+        # the largest radius is checked first
+        r_lo, r_hi = 0, len(simp_rs) - 1
+        poly_cand = poly.simplify(simp_rs[r_lo])
+        if is_sele(poly_cand):
+            poly_simp = poly_cand
+        elif r_hi > r_lo and (budget is None or not budget.is_hit):
+            # if the smallest radius meets thres_iou, the first radius meeting it is in (r_lo, r_hi]
+            poly_cand = poly.simplify(simp_rs[r_hi])
+            if is_sele(poly_cand):
+                poly_simp = poly_cand
+                while r_hi - r_lo > 1:
+                    r_mid = (r_lo + r_hi) // 2
+                    poly_cand = poly.simplify(simp_rs[r_mid])
+                    is_mid_sele = is_sele(poly_cand)
+                    if is_mid_sele is None:
+                        break
+                    if is_mid_sele:
+                        r_hi, poly_simp = r_mid, poly_cand
+                    else:
+                        r_lo = r_mid
+    else:
+        raise ValueError(f"The expected 'simp_search' is in ['ladder', 'bisect'], but {simp_search} was gotten.")
+
+    if poly_simp is None:
+        # no radius meets thres_iou (or out of budget): the smallest radius
+        poly_simp = poly.simplify(simp_rs[-1])
 
     b_oli_simp_ext, b_oli_simp_ints = get_PolygonCoords_withInter(poly_simp)
 
+    if return_converged:
+        return b_oli_simp_ext, b_oli_simp_ints, poly_simp, budget is None or not budget.is_hit
     return b_oli_simp_ext, b_oli_simp_ints, poly_simp
 
 
 
+def get_simp_cache_key(b_oli:shapely.geometry, method_name:str, kwargs:dict) -> str:
+    """
+    the key of a simp_by_choosed_mtd() result: the building's coordinates + the method and its params
+    :param b_oli:       the basic outline
+    :param method_name: see simp_by_choosed_mtd()
+    :param kwargs:      see simp_by_choosed_mtd(), params which do not change the result are ignored
+    :return:
+        the hex digest
+    """
+    geom_type, coords, offsets = shapely.to_ragged_array([b_oli])
+    key_hash = hashlib.sha256()
+    key_hash.update(str(int(geom_type)).encode())
+    # normalised coordinates: contiguous float64, -0.0 -> 0.0
+    key_hash.update((np.ascontiguousarray(coords, dtype=np.float64) + 0.0).tobytes())
+    for offset in offsets:
+        key_hash.update(b"|" + np.ascontiguousarray(offset, dtype=np.int64).tobytes())
+
+    simp_params = {k: v for k, v in kwargs.items()
+                   if k not in ["isDebug", "time_budget", "return_converged", "simp_cache"]}
+    key_hash.update(f"simp-v3:{method_name}:{json.dumps(simp_params, sort_keys=True, default=str)}".encode())
+    return key_hash.hexdigest()
+
+
+class SimpResCache:
+    """
+    memoization of simp_by_choosed_mtd() results, so that repeated buildings (e.g. from overlapping tiles or reruns)
+    are not simplified again. An in-process LRU tier, and an optional on-disk tier (DiskCache) shared by runs and
+    processes. When the cache is sent to worker processes, only the on-disk tier goes with it.
+    :param max_size:     the max. number of results in the in-process tier
+    :param cache_folder: the folder of the on-disk tier, None: no on-disk tier
+    :param max_size_mb:  see DiskCache
+    """
+    def __init__(self, max_size:int=4096, cache_folder:str=None, max_size_mb:float=1024):
+        self.max_size = max_size
+        self.mem_cache = OrderedDict()
+        self.disk_cache = DiskCache(cache_folder, max_size_mb=max_size_mb) if cache_folder is not None else None
+        self.hit_num, self.miss_num = 0, 0
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state["mem_cache"] = OrderedDict()
+        return state
+
+    def get(self, key:str, method_name:str) -> tuple or None:
+        """
+        :param key:         see get_simp_cache_key()
+        :param method_name: see simp_by_choosed_mtd()
+        :return:
+            (b_oli_simp_ext, b_oli_simp_ints, b_oli_simp, is_converged), None if the key is not cached
+        """
+        simp_res = self.mem_cache.get(key)
+        if simp_res is not None:
+            self.mem_cache.move_to_end(key)
+        elif self.disk_cache is not None:
+            cache_arrs = self.disk_cache.load(key)
+            if cache_arrs is not None:
+                simp_res = self.arrs2res(cache_arrs, method_name)
+                self.put_mem(key, simp_res)
+
+        if simp_res is None:
+            self.miss_num += 1
+            return None
+        self.hit_num += 1
+        # the coordinates are copied, so that the cached result is not changed by the caller
+        return copy.deepcopy(simp_res[0]), copy.deepcopy(simp_res[1]), simp_res[2], simp_res[3]
+
+    def put(self, key:str, method_name:str, simp_res:tuple):
+        self.put_mem(key, (copy.deepcopy(simp_res[0]), copy.deepcopy(simp_res[1]), simp_res[2], simp_res[3]))
+        if self.disk_cache is not None:
+            self.disk_cache.save(key, **self.res2arrs(simp_res, method_name))
+
+    def put_mem(self, key:str, simp_res:tuple):
+        self.mem_cache[key] = simp_res
+        self.mem_cache.move_to_end(key)
+        while len(self.mem_cache) > self.max_size:
+            self.mem_cache.popitem(last=False)
+
+    @staticmethod
+    def res2arrs(simp_res:tuple, method_name:str) -> dict:
+        b_oli_simp_ext, b_oli_simp_ints, b_oli_simp, is_converged = simp_res
+        cache_arrs = polys2Arrs([b_oli_simp])
+        cache_arrs["is_converged"] = np.asarray(is_converged)
+        if method_name != "extm":
+            # the FD coordinates are not closed, so they are saved besides the polygon
+            cache_arrs["ext"] = np.asarray(b_oli_simp_ext, dtype=np.float64)
+            cache_arrs["ints"] = np.concatenate([np.empty((0, 2))] + [np.asarray(_) for _ in b_oli_simp_ints])
+            cache_arrs["ints_offsets"] = np.cumsum([0] + [len(_) for _ in b_oli_simp_ints])
+        return cache_arrs
+
+    @staticmethod
+    def arrs2res(cache_arrs:dict, method_name:str) -> tuple:
+        b_oli_simp = arrs2Polys(cache_arrs["coords"], cache_arrs["ring_offsets"], cache_arrs["poly_offsets"])[0]
+        if method_name == "extm":
+            b_oli_simp_ext, b_oli_simp_ints = get_PolygonCoords_withInter(b_oli_simp)
+        else:
+            ints_offsets = cache_arrs["ints_offsets"]
+            b_oli_simp_ext = cache_arrs["ext"]
+            b_oli_simp_ints = [cache_arrs["ints"][st:ed] for st, ed in zip(ints_offsets[:-1], ints_offsets[1:])]
+        return b_oli_simp_ext, b_oli_simp_ints, b_oli_simp, bool(cache_arrs["is_converged"])
+
+
 def simp_by_choosed_mtd(b_oli:shapely.geometry, method_name:str="haus", **kwargs):
     assert method_name in ["iou", "haus", "extm"], \
         ValueError(f"only method_name in ['iou;, 'haus', 'extm'] is accecpted, but {method_name} was gotten.")
+    # time / evaluation budget of the building, see simp_poly_Fd() and simp_poly_Extmtd().
+    # With return_converged, is_converged is returned as the 4th element. fallback_tole: see simp_poly_Fd()
+    budget_kwargs = {k: kwargs[k] for k in ["time_budget", "eval_budget", "return_converged"] if k in kwargs}
+    if method_name in ["haus", "iou"] and "fallback_tole" in kwargs:
+        budget_kwargs["fallback_tole"] = kwargs["fallback_tole"]
+
+    # memoization by the building's coordinates + method and params, see SimpResCache
+    simp_cache = kwargs.get("simp_cache")
+    if simp_cache is not None:
+        return_converged = kwargs.get("return_converged", False)
+        cache_key = get_simp_cache_key(b_oli, method_name, kwargs)
+        simp_res = simp_cache.get(cache_key, method_name)
+        if simp_res is not None:
+            return simp_res if return_converged else simp_res[:3]
+        budget_kwargs["return_converged"] = True
 
     if method_name=="haus":
         try:
             thres_haus, isDebug = kwargs["thres_haus"], kwargs["isDebug"]
         except Exception as e:
             raise e
-        b_oli_simp_ext, b_oli_simp_ints, b_oli_simp = simp_poly_Fd(b_oli, thres_mode="haus", thres_haus=thres_haus,
-                                                                   isDebug=isDebug)
+        simp_res = simp_poly_Fd(b_oli, thres_mode="haus", thres_haus=thres_haus,
+                                isDebug=isDebug,
+                                fd_engine=kwargs.get("fd_engine", "loop"),
+                                is_resample=kwargs.get("is_resample", False),
+                                resample_tole=kwargs.get("resample_tole", 0.5),
+                                resample_factor=kwargs.get("resample_factor", 4),
+                                resample_haus_ratio=kwargs.get("resample_haus_ratio", 0.25),
+                                **budget_kwargs)
     elif method_name=="iou":
         try:
             thres_simparea, isDebug = kwargs["thres_simparea"], kwargs["isDebug"]
         except Exception as e:
             raise e
-        b_oli_simp_ext, b_oli_simp_ints, b_oli_simp = simp_poly_Fd(b_oli, thres_mode="iou", thres_simparea=thres_simparea)
+        simp_res = simp_poly_Fd(b_oli, thres_mode="iou", thres_simparea=thres_simparea,
+                                fd_engine=kwargs.get("fd_engine", "loop"),
+                                is_resample=kwargs.get("is_resample", False),
+                                resample_tole=kwargs.get("resample_tole", 0.5),
+                                resample_factor=kwargs.get("resample_factor", 4),
+                                resample_haus_ratio=kwargs.get("resample_haus_ratio", 0.25),
+                                **budget_kwargs)
     else:
         try:
             bfr_otdiff, bfr_tole = kwargs["bfr_otdiff"], kwargs["bfr_tole"]
         except Exception as e:
             raise e
-        b_oli_simp_ext, b_oli_simp_ints, b_oli_simp = simp_poly_Extmtd(b_oli, bfr_otdiff=bfr_otdiff, bfr_tole=bfr_tole)
+        simp_res = simp_poly_Extmtd(b_oli, bfr_otdiff=bfr_otdiff, bfr_tole=bfr_tole,
+                                    simp_search=kwargs.get("simp_search", "ladder"),
+                                    **budget_kwargs)
+
+    if simp_cache is not None:
+        # a result cut by the time budget depends on the machine load, it is not cached
+        if simp_res[3] or kwargs.get("time_budget") is None:
+            simp_cache.put(cache_key, method_name, simp_res)
+        if not return_converged:
+            simp_res = simp_res[:3]
+
+    return simp_res
 
-    return b_oli_simp_ext, b_oli_simp_ints, b_oli_simp
 
 
 
+def simp_by_choosed_mtd_safe(b_oli:shapely.geometry, method_name:str, kwargs:dict) -> (tuple, str):
+    # run simp_by_choosed_mtd(), a failed building returns its traceback instead of stopping the whole batch
+    try:
+        return simp_by_choosed_mtd(b_oli, method_name, **kwargs), None
+    except Exception:
+        return None, traceback.format_exc()
+
+
+def simp_by_choosed_mtd_batch(b_olis:list, method_name:str="haus", n_workers:int=1, chunksize:int=1,
+                              **kwargs) -> (list, dict):
+    """
+    simplify many buildings by simp_by_choosed_mtd(), in a process pool if n_workers > 1.
+    The buildings are scheduled largest-first by vertex number, so that a huge building does not start last
+    and keep the other workers idle.
+    :param b_olis:      the basic outlines (Polygons) of the buildings
+    :param method_name: see simp_by_choosed_mtd()
+    :param n_workers:   the number of worker processes, 1: no process pool
+    :param chunksize:   the number of buildings sent to a worker at once
+    :param kwargs:      see simp_by_choosed_mtd()
+    :return:
+        results:        (b_oli_simp_ext, b_oli_simp_ints, b_oli_simp) of each building, in the order of b_olis,
+                        None if the building failed
+        failures:       {index of the building in b_olis: traceback}
+    """
+    b_olis = list(b_olis)
+    vertex_nums = shapely.get_num_coordinates(np.asarray(b_olis, dtype=object))
+    b_order = np.argsort(-vertex_nums, kind="stable")
+    b_olis_sorted = [b_olis[bi] for bi in b_order]
+
+    if n_workers > 1 and len(b_olis) > 1:
+        with ProcessPoolExecutor(max_workers=min(n_workers, len(b_olis))) as executor:
+            simp_outs = list(executor.map(simp_by_choosed_mtd_safe, b_olis_sorted, repeat(method_name),
+                                          repeat(kwargs), chunksize=chunksize))
+    else:
+        simp_outs = [simp_by_choosed_mtd_safe(b_oli, method_name, kwargs) for b_oli in b_olis_sorted]
+
+    results, failures = [None] * len(b_olis), {}
+    for bi, (simp_res, simp_err) in zip(b_order, simp_outs):
+        results[bi] = simp_res
+        if simp_err is not None:
+            failures[int(bi)] = simp_err
+    return results, failures
+
+
 
 if __name__ == "__main__":
     simp_by_choosed_mtd("haus", thres_haus = 0.5)
\ No newline at end of file
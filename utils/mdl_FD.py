@@ -71,6 +71,35 @@ def recon_by_fdLow(fdLow:np.ndarray, scale:float=1) -> np.ndarray:
     return contRebuild
 
 
+def recon_by_fd_batch(fd_shift:np.ndarray, top_nums:np.ndarray, scale:float=1) -> (np.ndarray, np.ndarray):
+    """
+    reconstruct the shapes of several truncation levels from one shifted FD,
+    the same result as recon_by_fdLow(trunc_fft(fd, top_num), scale) for each top_num
+    :param fd_shift: shape=(K, ), complex format (x+jy), the FD after np.fft.fftshift (shifted once for all levels)
+    :param top_nums: shape=(B, ), the trunc nums (>=2), see trunc_fft()
+    :param scale:    the max(x-value, y-value) scale, see recon_by_fdLow()
+    :return:
+           contRebuild: shape=[sum(P_b), 2], the rebuilt shapes of all levels, concatenated
+           offsets:     shape=(B+1, ), contRebuild[offsets[b]:offsets[b+1]] is the shape rebuilt by top_nums[b]
+    """
+    center = int(len(fd_shift) / 2)
+    halfs = np.asarray(top_nums, dtype=int) // 2   # the trunc FD keeps frequencies [-half, half-1]
+    pt_nums = 2 * halfs                             # P of each level
+    offsets = np.concatenate(([0], np.cumsum(pt_nums)))
+    pt_level = np.repeat(np.arange(len(halfs)), pt_nums)
+
+    # inv fft of each level (the slices of the shifted FD are views, no re-shift of the whole FD per level)
+    ifft = np.concatenate([np.fft.ifft(np.fft.ifftshift(fd_shift[center - half:center + half])) for half in halfs])
+
+    contRebuild = np.stack((ifft.real, ifft.imag), axis=-1)  # complex to arr[real, imag]
+    # per level: move min to 0 (if min<0), then scale max to the scale
+    level_min = np.minimum(np.minimum.reduceat(contRebuild.min(axis=1), offsets[:-1]), 0)
+    contRebuild -= level_min[pt_level][:, None]
+    level_max = np.maximum.reduceat(contRebuild.max(axis=1), offsets[:-1])
+    contRebuild *= (scale / level_max)[pt_level][:, None]
+    return contRebuild, offsets
+
+
 def simp_shape_fft(shape_pts:np.ndarray, top_num:int):
 
     # normalize data
@@ -7,163 +7,249 @@
 calculate PH by gudhi
 """
 
+import os
 import gudhi
 import numpy as np
 import time
 import pandas as pd
+from scipy.sparse import coo_matrix
+from scipy.sparse.csgraph import minimum_spanning_tree
+from scipy.spatial import Delaunay, QhullError, cKDTree
+
+
+
+def get_mst_cand_edges(pts):
+    # the candidate edges (i < j) containing the Euclidean MST: the Delaunay edges
+    pts = pts - np.mean(pts, axis=0)  # qhull drops most points as coplanar at large map coordinates
+    try:
+        tri = Delaunay(pts)
+        indptr, indices = tri.vertex_neighbor_vertices
+        edge_st, edge_ed = np.repeat(np.arange(len(pts)), np.diff(indptr)), indices
+        coplanar = tri.coplanar[:, 0]
+    except QhullError:  # less than 3 points, or collinear points: the neighbouring points along the line
+        pt_order = np.lexsort(pts.T[::-1])
+        edge_st, edge_ed = pt_order[:-1], pt_order[1:]
+        coplanar = np.empty(0, dtype=int)
+
+    if len(coplanar) > 0:
+        # the points dropped by qhull (nearly coincident with others): the edges to their nearest points
+        nn_num = min(9, len(pts))
+        _, nn_idx = cKDTree(pts).query(pts[coplanar], k=nn_num)
+        edge_st = np.concatenate([edge_st, np.repeat(coplanar, nn_num - 1)])
+        edge_ed = np.concatenate([edge_ed, nn_idx[:, 1:].ravel()])
+
+    # unique edges, encoded as i * n + j
+    edge_keys = np.unique(np.minimum(edge_st, edge_ed) * len(pts) + np.maximum(edge_st, edge_ed))
+    edge_st, edge_ed = np.divmod(edge_keys, len(pts))
+    is_used = edge_st != edge_ed
+    return edge_st[is_used], edge_ed[is_used]
+
+def get_mst_edge_len2(pts:np.ndarray) -> np.ndarray:
+    """
+    the squared edge lengths of the Euclidean minimum spanning tree, duplicated points are merged
+    :param pts: shape=[n, d]
+    :return:
+        sorted squared edge lengths, shape=[n_unique - 1,]
+    """
+    pts = pts[np.lexsort(pts.T[::-1])]
+    pts = pts[np.r_[True, np.any(pts[1:] != pts[:-1], axis=1)]]
+    pt_num = len(pts)
+
+    edge_st, edge_ed = get_mst_cand_edges(pts)
+    edge_len2 = np.sum((pts[edge_st] - pts[edge_ed]) ** 2, axis=1)
+    # the MST of the squared lengths is the MST of the lengths
+    edge_graph = coo_matrix((edge_len2, (edge_st, edge_ed)), shape=(pt_num, pt_num))
+    return np.sort(minimum_spanning_tree(edge_graph).data)
+
+
+def get_rss_kb() -> float or None:
+    # the resident memory (KB) of the process, None if it is not supported (no /proc, e.g. Windows)
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 1024
+    except (OSError, ValueError, AttributeError):
+        return None
+
+
+def get_auto_edge_length(data:np.ndarray, edge_cap_factor:float=2.0) -> float:
+    """
+    the edge length cap of the Rips complex by a cheap 0-d pass:
+    edge_cap_factor * the longest edge of the Euclidean MST, i.e. of the radius where all points are connected.
+    0-d PH is not changed by the cap (if edge_cap_factor >= 1), 1-d features dying above the cap never die.
+    :param data:
+    :param edge_cap_factor:
+    :return:
+    """
+    mst_len2 = get_mst_edge_len2(data)
+    if len(mst_len2) == 0:
+        return 0.
+    return edge_cap_factor * np.sqrt(mst_len2[-1])
 
 
+def crt_simptree_gu(data:np.ndarray, max_dim:int, max_edge_length:float or str=None, sparse:float=None,
+                    is_collapse:bool=False, collapse_iters:int=1, edge_cap_factor:float=2.0,
+                    isDebug:bool=False, return_info:bool=False) -> gudhi.SimplexTree:
+    """
+    create the simplex tree of the VR (Rips) complex
+    :param data:
+    :param max_dim:         the max. dimension of the simplices
+    :param max_edge_length: the max. edge length of the Rips complex, None: no cap,
+                            "auto": by get_auto_edge_length()
+    :param sparse:          None: the whole Rips complex, otherwise the epsilon of the sparse Rips approximation
+    :param is_collapse:     whether to collapse the edges before the expansion to max_dim, PH is not changed
+    :param collapse_iters:  the number of iterations of the edge collapse
+    :param edge_cap_factor: see get_auto_edge_length()
+    :param isDebug:         print the simplex counts and memory
+    :param return_info:     whether to return the construction info
+    :return:
+        simplex_tree
+        simptree_info: (only if return_info) {"max_edge_length", "simplex_num", "simplex_num_by_dim",
+                       "collapsed_edge_num", "rss_inc_kb" (memory held by the simplex tree, None if not supported),
+                       "time"}
+    """
+    st_time, st_rss = time.time(), get_rss_kb()
+
+    if max_edge_length is None:
+        max_edge_length = np.inf
+    elif max_edge_length == "auto":
+        max_edge_length = get_auto_edge_length(data, edge_cap_factor)
 
-def crt_simptree_gu(data:np.ndarray, max_dim:int) -> gudhi.SimplexTree:
     ####################
     # create VR complex
     ####################
-    rips_complex = gudhi.RipsComplex(points=data)
+    rips_complex = gudhi.RipsComplex(points=data, max_edge_length=max_edge_length, sparse=sparse)
 
     ####################
     # create simplex tree
     ####################
-    simplex_tree = rips_complex.create_simplex_tree(max_dimension=max_dim)  # 2 let 0- and 1-d PH can be tracked
+    collapsed_edge_num = 0
+    if is_collapse and max_dim > 1:
+        # only the 1-skeleton (graph) is collapsed, then expanded
+        simplex_tree = rips_complex.create_simplex_tree(max_dimension=1)
+        collapsed_edge_num = simplex_tree.num_simplices()
+        simplex_tree.collapse_edges(nb_iterations=collapse_iters)
+        collapsed_edge_num -= simplex_tree.num_simplices()
+        simplex_tree.expansion(max_dim)
+    else:
+        simplex_tree = rips_complex.create_simplex_tree(max_dimension=max_dim)  # 2 let 0- and 1-d PH can be tracked
+
+    ed_rss = get_rss_kb()
+    simptree_info = {"max_edge_length": float(max_edge_length),
+                     "simplex_num": simplex_tree.num_simplices(),
+                     "simplex_num_by_dim": simplex_tree.num_simplices_by_dimension(),
+                     "collapsed_edge_num": collapsed_edge_num,
+                     "rss_inc_kb": None if st_rss is None else ed_rss - st_rss,
+                     "time": time.time() - st_time}
+    if isDebug:
+        print(f"[crt_simptree_gu()] :: {simptree_info}")
 
+    if return_info:
+        return simplex_tree, simptree_info
     return simplex_tree
 
 
-def calc_PH_0d_gu(data:np.ndarray, isDebug=False) -> (pd.DataFrame, float):
+class PersGu:
+    """
+    PH of a point set by gudhi: the simplex tree is built and its persistence is computed once,
+    the finite <birth, death> pairs of each dimension are given as arrays, DataFrames only on request.
+    :param data:
+    :param max_dim:  the max. dimension of the simplices, 1: 0-d PH, 2: 0- and 1-d PH
+    :param rips_cfg: the construction params of the Rips complex, see crt_simptree_gu()
+    :param isDebug:
+    """
+    def __init__(self, data:np.ndarray, max_dim:int=2, rips_cfg:dict=None, isDebug:bool=False):
+        if isDebug:
+            st_time = time.time()
+            print(f"[PersGu()] :: start to compute PH...")
+
+        ####################
+        # get simplex tree
+        ####################
+        self.simplex_tree = crt_simptree_gu(data, max_dim=max_dim, isDebug=isDebug, **(rips_cfg or {}))
+
+        ####################
+        # comput persistence homology
+        ####################
+        self.simplex_tree.compute_persistence()
+        self.pers_arrs = {}
+
+        if isDebug:
+            ed_time = time.time()
+            print(f"[PersGu()] :: finish PH computation, time={ed_time - st_time}(s).")
+
+    def get_pers(self, dim:int) -> np.ndarray:
+        """
+        :param dim:
+        :return:
+            the finite <birth, death> pairs at dim, shape=[n, 2],
+            in the order of simplex_tree.persistence() (by persistence, large->small)
+        """
+        if dim not in self.pers_arrs:
+            pers = self.simplex_tree.persistence_intervals_in_dimension(dim).reshape(-1, 2)
+            pers = pers[np.isfinite(pers[:, 1])]
+            self.pers_arrs[dim] = pers[np.argsort(pers[:, 0] - pers[:, 1], kind="stable")]
+        return self.pers_arrs[dim]
+
+    def get_maxr(self, dim:int) -> float:
+        # the needed radius: 0-d: max pers / 2, 1-d: max death / 2
+        pers = self.get_pers(dim)
+        if dim == 0:
+            return (pers[:, 1] - pers[:, 0]).max() * 1 / 2
+        return pers[:, 1].max() * 1 / 2
+
+    def get_pers_df(self, dim:int) -> pd.DataFrame:
+        # dataframe saving the pers pairs info, columns=[birth, death, pers]
+        pers = pd.DataFrame(self.get_pers(dim), columns=["birth", "death"])
+        pers["pers"] = pers["death"] - pers["birth"]
+        return pers
+
+
+def calc_PH_0d_gu(data:np.ndarray, isDebug=False, rips_cfg:dict=None, is_df:bool=True) -> (pd.DataFrame, float):
     """
     run 0-d PH by gudhi
     :param data:
     :param isDebug:
+    :param rips_cfg: the construction params of the Rips complex, see crt_simptree_gu()
+    :param is_df:    False: pers_0d is the array of [birth, death], see PersGu.get_pers()
     :return:
         pers_0d: dataframe saving the pers pairs info.
                  columns=[birth, death, pers]
         maxr_0d: max pers time in pers_0d
     """
-    if isDebug:
-        st_time = time.time()
-        print(f"[calc_PH_0d_gu()] :: start to compute PH...")
-
-    ####################
-    # get simplex tree
-    ####################
-    simplex_tree = crt_simptree_gu(data, max_dim=1)
-
-    ####################
-    # comput persistence homology
-    # format: [[dim, (birth, death)], [dim, (birth, death)], ...]
-    ####################
-    diag = simplex_tree.persistence()
-
-
-    if isDebug:
-        ed_time = time.time()
-        print(f"[calc_PH_0d_gu()] :: finish PH computation, time={ed_time-st_time}(s).")
-
-    ####################
-    # flat diag
-    # and get 0d and 1d pers and needed radius
-    ####################
-    # 1. flat diag to shape=[n, 3], where n is the number of <birth, death> pairs at 0 and 1 dimension
-    diag_flat = np.array([[_[0], _[1][0], _[1][1]] for _ in diag if _[1][1] != np.inf])
-
-    # 2. get 0d pers & the needed radius
-    diag_0d = diag_flat[diag_flat[:, 0] == 0]
-    pers_0d = pd.DataFrame(diag_0d[:, 1:], columns=["birth", "death"])
-    pers_0d["pers"] = pers_0d["death"] - pers_0d["birth"]
-    # get max radius
-    maxr_0d = pers_0d.loc[:, 'pers'].values.max() * 1/2
+    ph_gu = PersGu(data, max_dim=1, rips_cfg=rips_cfg, isDebug=isDebug)
+    pers_0d = ph_gu.get_pers_df(0) if is_df else ph_gu.get_pers(0)
 
+    return pers_0d, ph_gu.get_maxr(0)
 
-    return pers_0d, maxr_0d
 
-
-def calc_PH_1d_gu(data: np.ndarray, isDebug=False):
+def calc_PH_1d_gu(data: np.ndarray, isDebug=False, rips_cfg:dict=None, is_df:bool=True):
     """
     run 1-d PH by gudhi
     :param data:
     :param isDebug:
+    :param rips_cfg: the construction params of the Rips complex, see crt_simptree_gu()
+    :param is_df:    False: pers_1d is the array of [birth, death], see PersGu.get_pers()
     :return:
     """
-    if isDebug:
-        st_time = time.time()
-        print(f"[calc_PH_1d_gu()] :: start to compute PH...")
-
-    ####################
-    # get simplex tree
-    ####################
-    simplex_tree = crt_simptree_gu(data, max_dim=2)
-
-    ####################
-    # comput persistence homology
-    # format: [[dim, (birth, death)], [dim, (birth, death)], ...]
-    ####################
-    diag = simplex_tree.persistence()
-
-    if isDebug:
-        ed_time = time.time()
-        print(f"[calc_PH_1d_gu()] :: finish PH computation, time={ed_time - st_time}(s).")
-
-    ####################
-    # flat diag
-    # and get 0d and 1d pers and needed radius
-    ####################
-    # 1. flat diag to shape=[n, 3], where n is the number of <birth, death> pairs at 0 and 1 dimension
-    diag_flat = np.array([[_[0], _[1][0], _[1][1]] for _ in diag if _[1][1] != np.inf])
-
-    # 3. get 1d pers
-    diag_1d = diag_flat[diag_flat[:, 0] == 1]
-    pers_1d = pd.DataFrame(diag_1d[:, 1:], columns=["birth", "death"])
-    pers_1d["pers"] = pers_1d["death"] - pers_1d["birth"]
-    # get max radius
-    maxr_1d = pers_1d.loc[:, 'death'].values.max() * 1 / 2
+    ph_gu = PersGu(data, max_dim=2, rips_cfg=rips_cfg, isDebug=isDebug)
+    pers_1d = ph_gu.get_pers_df(1) if is_df else ph_gu.get_pers(1)
 
-    return pers_1d, maxr_1d
+    return pers_1d, ph_gu.get_maxr(1)
 
 
-def calc_PH_gu(data: np.ndarray, isDebug=False):
+def calc_PH_gu(data: np.ndarray, isDebug=False, rips_cfg:dict=None, is_df:bool=True):
     """
     run 0- and 1-d PH by gudhi
     :param data:
     :param isDebug:
+    :param rips_cfg: the construction params of the Rips complex, see crt_simptree_gu()
+    :param is_df:    False: pers_0d and pers_1d are the arrays of [birth, death], see PersGu.get_pers()
     :return:
     """
-    if isDebug:
-        st_time = time.time()
-        print(f"[calc_PH_gu()] :: start to compute PH...")
-
-    simplex_tree = crt_simptree_gu(data, max_dim=2)
-
-
-    ####################
-    # comput persistence homology
-    # format: [[dim, (birth, death)], [dim, (birth, death)], ...]
-    ####################
-    diag = simplex_tree.persistence()
-    # print(simplex_tree.persistence_pairs())
-    if isDebug:
-        ed_time = time.time()
-        print(f"[calc_PH_gu()] :: finish PH computation, time={ed_time - st_time}(s).")
-
-    ####################
-    # flat diag
-    # and get 0d and 1d pers and needed radius
-    ####################
-    # 1. flat diag to shape=[n, 3], where n is the number of <birth, death> pairs at 0 and 1 dimension
-    diag_flat = np.array([[_[0], _[1][0], _[1][1]] for _ in diag if _[1][1] != np.inf])
-
-    # 2. get 0d pers & the needed radius
-    diag_0d = diag_flat[diag_flat[:, 0] == 0]
-    pers_0d = pd.DataFrame(diag_0d[:, 1:], columns=["birth", "death"])
-    pers_0d["pers"] = pers_0d["death"] - pers_0d["birth"]
-    # get max radius
-    maxr_0d = pers_0d.loc[:, 'pers'].values.max() * 1 / 2
-
-    # 3. get 1d pers
-    diag_1d = diag_flat[diag_flat[:, 0] == 1]
-    pers_1d = pd.DataFrame(diag_1d[:, 1:], columns=["birth", "death"])
-    pers_1d["pers"] = pers_1d["death"] - pers_1d["birth"]
-    # get max radius
-    maxr_1d = pers_1d.loc[:, 'death'].values.max() * 1 / 2
-
-    return pers_0d, maxr_0d, pers_1d, maxr_1d
-
+    ph_gu = PersGu(data, max_dim=2, rips_cfg=rips_cfg, isDebug=isDebug)
+    if is_df:
+        pers_0d, pers_1d = ph_gu.get_pers_df(0), ph_gu.get_pers_df(1)
+    else:
+        pers_0d, pers_1d = ph_gu.get_pers(0), ph_gu.get_pers(1)
 
+    return pers_0d, ph_gu.get_maxr(0), pers_1d, ph_gu.get_maxr(1)
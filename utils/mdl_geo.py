@@ -11,6 +11,7 @@ import numpy as np
 import pandas as pd
 
 import shapely
+from scipy.spatial import cKDTree
 from shapely import wkt
 from shapely.ops import unary_union
 from shapely.geometry import Polygon, LineString, Point, MultiPoint, MultiPolygon, mapping
@@ -64,13 +65,39 @@ def get_PolygonCoords_withInter(polygon:shapely.geometry) -> (list, list):
     return poly_exter, poly_inter
 
 
+def round_geo_coords(geo_obj:shapely.geometry, round_precision:int) -> shapely.geometry:
+    # round all coordinates at once on the coordinate array, without a WKT text round trip
+    return shapely.transform(geo_obj, lambda coords: np.round(coords, round_precision))
+
 def poly2Geojson(polygon:shapely.geometry, round_precision:int=-1) -> dict:
     if round_precision>=0:
-        polygon = wkt.loads(wkt.dumps(polygon, rounding_precision=round_precision))
+        polygon = round_geo_coords(polygon, round_precision)
 
     poly_json = mapping(polygon)
     return poly_json
 
+def polys2Arrs(polygons:list) -> dict:
+    """
+    convert a list of Polygons to flat arrays (coordinates + offsets of rings and polygons), e.g. to save them by numpy
+    :param polygons: list of Polygons
+    :return:
+        dict: {"coords": shape=[n,2], "ring_offsets": shape=[r+1,], "poly_offsets": shape=[p+1,]}
+    """
+    if len(polygons) == 0:
+        return {"coords": np.empty((0, 2)), "ring_offsets": np.zeros(1, dtype=np.int64),
+                "poly_offsets": np.zeros(1, dtype=np.int64)}
+    _, coords, (ring_offsets, poly_offsets) = shapely.to_ragged_array(polygons)
+    return {"coords": coords, "ring_offsets": ring_offsets, "poly_offsets": poly_offsets}
+
+def arrs2Polys(coords:np.ndarray, ring_offsets:np.ndarray, poly_offsets:np.ndarray) -> list:
+    """
+    the inverse of polys2Arrs()
+    """
+    if len(poly_offsets) <= 1:
+        return []
+    polygons = shapely.from_ragged_array(shapely.GeometryType.POLYGON, coords, (ring_offsets, poly_offsets))
+    return list(polygons)
+
 def poly2WKT(polygon:shapely.geometry, round_precision:int=-1) -> str:
     if round_precision>=0:
         poly_wkt = wkt.dumps(polygon, rounding_precision=round_precision)
@@ -93,6 +120,134 @@ def create_buffer(geo_obj:shapely.geometry, b_radius:float) -> Polygon:
     bf = geo_obj.buffer(b_radius)
     return bf
 
+def get_ring_segs(ring_arr:np.ndarray) -> (np.ndarray, np.ndarray, np.ndarray, np.ndarray, cKDTree):
+    """
+    precompute the segments of a ring, to be reused by all the distance queries against it
+    :param ring_arr: shape=[K, 2], the pts of the ring, closed or not (the last pt is connected to the first one)
+    :return:
+        ring_pts:  shape=[K, 2], the pts of the ring (= the start pt of each segment)
+        seg_vec:   shape=[K, 2], the vector of each segment (end - start)
+        seg_len2:  shape=(K, ), the squared length of each segment, 1 for zero-length segments (duplicated pts)
+        ring_tree: the KD-tree of ring_pts
+    """
+    ring_pts = np.asarray(ring_arr, dtype=float)
+    seg_vec = np.roll(ring_pts, -1, axis=0) - ring_pts
+    seg_len2 = np.einsum("ij,ij->i", seg_vec, seg_vec)
+    seg_len2[seg_len2 == 0] = 1 # the distance to a zero-length segment is the distance to its start pt
+    return ring_pts, seg_vec, seg_len2, cKDTree(ring_pts)
+
+def get_pts_segs_dist2(pts_x:np.ndarray, pts_y:np.ndarray,
+                       seg_st:np.ndarray, seg_vec:np.ndarray, seg_len2:np.ndarray) -> np.ndarray:
+    """
+    the squared point-to-segment distances, broadcast between the pts and the segments,
+    e.g. pts_x/pts_y of shape=[N, 1] and K segments -> [N, K], or pts_x/pts_y of shape=(N, ) and N segments -> (N, )
+    :param pts_x, pts_y:               the x, y of the pts
+    :param seg_st, seg_vec, seg_len2:  the segments, see get_ring_segs()
+    :return:
+        the squared distances
+    """
+    dx = pts_x - seg_st[..., 0]
+    dy = pts_y - seg_st[..., 1]
+    t = np.clip((dx * seg_vec[..., 0] + dy * seg_vec[..., 1]) / seg_len2, 0, 1)
+    dx -= t * seg_vec[..., 0]
+    dy -= t * seg_vec[..., 1]
+    return dx * dx + dy * dy
+
+def get_pts_dist2_ub(pts:np.ndarray, ring_segs:tuple) -> np.ndarray:
+    """
+    an upper bound of the squared distance of each pt to the ring:
+    the distance to the 2 segments starting and ending at the nearest vertex of the ring
+    :param pts:       shape=[N, 2], the pts
+    :param ring_segs: the ring, by get_ring_segs()
+    :return:
+        shape=(N, ), the upper bounds
+    """
+    seg_st, seg_vec, seg_len2, ring_tree = ring_segs
+    vtx_idx = ring_tree.query(pts)[1]
+    return np.minimum(
+        get_pts_segs_dist2(pts[:, 0], pts[:, 1], seg_st[vtx_idx], seg_vec[vtx_idx], seg_len2[vtx_idx]),
+        get_pts_segs_dist2(pts[:, 0], pts[:, 1], seg_st[vtx_idx - 1], seg_vec[vtx_idx - 1], seg_len2[vtx_idx - 1]))
+
+def is_pts_near_segs(pts:np.ndarray, ring_segs:tuple, thres:float, chunk_size:int=64) -> bool:
+    """
+    whether all pts are within the distance thres to the ring, by point-to-segment distances.
+    The pts within thres by the upper bound get_pts_dist2_ub() are skipped, the others are checked chunk by chunk
+    (farthest by the upper bound first), and the check stops at the first chunk with a pt farther than thres.
+    :param pts:        shape=[N, 2], the pts
+    :param ring_segs:  the ring, by get_ring_segs()
+    :param thres:      the distance threshold
+    :param chunk_size: the number of pts checked at once
+    :return:
+        True if max(dist(pt, ring)) <= thres
+    """
+    seg_st, seg_vec, seg_len2, _ = ring_segs
+    thres2 = thres * thres
+    dist2_ub = get_pts_dist2_ub(pts, ring_segs)
+    is_check = dist2_ub > thres2
+    pts = pts[is_check][np.argsort(-dist2_ub[is_check])]
+
+    for chunk_st in range(0, pts.shape[0], chunk_size):
+        pts_chunk = pts[chunk_st:chunk_st + chunk_size]
+        dist2 = get_pts_segs_dist2(pts_chunk[:, 0:1], pts_chunk[:, 1:2], seg_st, seg_vec, seg_len2) # [n, K]
+        if np.any(np.min(dist2, axis=1) > thres2):
+            return False
+    return True
+
+def get_pts_max_dist(pts:np.ndarray, ring_segs:tuple, chunk_size:int=16) -> float:
+    """
+    the max. distance of pts to the ring (directed hausdorff distance), by point-to-segment distances.
+    The distance of a pt to the 2 segments at its nearest vertex is an upper bound of its distance to the ring,
+    so the pts are checked in descending order of this upper bound,
+    and the check stops when the upper bound of the rest pts is not larger than the max. distance.
+    :param pts:        shape=[N, 2], the pts
+    :param ring_segs:  the ring, by get_ring_segs()
+    :param chunk_size: the number of pts checked at once
+    :return:
+        max(dist(pt, ring))
+    """
+    seg_st, seg_vec, seg_len2, _ = ring_segs
+    dist2_ub = get_pts_dist2_ub(pts, ring_segs)
+    pts_order = np.argsort(-dist2_ub)
+
+    max_dist2 = 0
+    for chunk_st in range(0, pts.shape[0], chunk_size):
+        if dist2_ub[pts_order[chunk_st]] <= max_dist2:
+            break
+        pts_chunk = pts[pts_order[chunk_st:chunk_st + chunk_size]]
+        dist2 = get_pts_segs_dist2(pts_chunk[:, 0:1], pts_chunk[:, 1:2], seg_st, seg_vec, seg_len2) # [n, K]
+        max_dist2 = max(max_dist2, np.min(dist2, axis=1).max())
+    return float(np.sqrt(max_dist2))
+
+def get_hausdorff(ring_arr:np.ndarray, ref_segs:tuple, chunk_size:int=16) -> float:
+    """
+    the hausdorff distance between a ring and a reference ring,
+    the same as shapely's (discrete) hausdorff_distance(Polygon(ring_arr), Polygon(ref_ring))
+    :param ring_arr:   shape=[N, 2], the pts of the ring
+    :param ref_segs:   the reference ring, by get_ring_segs(), computed once for all rings compared with it
+    :param chunk_size: see get_pts_max_dist()
+    :return:
+        the hausdorff distance
+    """
+    ring_arr = np.asarray(ring_arr, dtype=float)
+    return max(get_pts_max_dist(ring_arr, ref_segs, chunk_size),
+               get_pts_max_dist(ref_segs[0], get_ring_segs(ring_arr), chunk_size))
+
+def is_hausdorff_within(ring_arr:np.ndarray, ref_segs:tuple, thres:float, chunk_size:int=64) -> bool:
+    """
+    whether the hausdorff distance between a ring and a reference ring is <= thres,
+    the same as shapely's (discrete) hausdorff_distance(Polygon(ring_arr), Polygon(ref_ring)) <= thres
+    :param ring_arr:   shape=[N, 2], the pts of the ring to be checked
+    :param ref_segs:   the reference ring, by get_ring_segs(), computed once for all rings checked against it
+    :param thres:      the hausdorff distance threshold
+    :param chunk_size: see is_pts_near_segs()
+    :return:
+        True if hausdorff distance <= thres
+    """
+    ring_arr = np.asarray(ring_arr, dtype=float)
+    if not is_pts_near_segs(ring_arr, ref_segs, thres, chunk_size):
+        return False
+    return is_pts_near_segs(ref_segs[0], get_ring_segs(ring_arr), thres, chunk_size)
+
 
 class arr2Geo:
     """
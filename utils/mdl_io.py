@@ -7,8 +7,19 @@
 
 """
 import os
+import glob
+import json
+import hashlib
+import tempfile
+import zipfile
 import numpy as np
 import rasterio
+import shapely
+from shapely.geometry import mapping
+from utils.mdl_geo import polys2Arrs, round_geo_coords
+
+# file extension of each output format
+OUT_FORMAT_EXT = {"geojson": ".json", "geojsonseq": ".geojsonl", "flatgeobuf": ".fgb", "geoparquet": ".parquet"}
 
 def create_folder(folder_path):
     if not os.path.exists(folder_path):
@@ -31,7 +42,223 @@ def save_json(data, file_path):
     with open(file_path, 'w') as f:
         json.dump(data, f)
 
+def save_geojson_polys(polygons, file_path, round_precision=-1, properties=None):
+    """
+    save polygons as a GeoJSON FeatureCollection with a single MultiPolygon feature.
+    The text is written directly from the coordinate arrays,
+    the same output as save_json(FeatureCollection of mapping(MultiPolygon(polygons)))
+    :param polygons:        list of Polygons
+    :param file_path:
+    :param round_precision: number of decimals to keep, -1: no rounding
+    :param properties:      properties of the feature
+    :return:
+    """
+    arrs = polys2Arrs(list(polygons))
+    coords, ring_offsets, poly_offsets = arrs["coords"], arrs["ring_offsets"], arrs["poly_offsets"]
+    if round_precision >= 0:
+        coords = np.round(coords, round_precision)
+
+    with open(file_path, 'w') as f:
+        f.write('{"type": "FeatureCollection", "features": [{"type": "Feature", '
+                '"geometry": {"type": "MultiPolygon", "coordinates": [')
+        for pi in range(len(poly_offsets) - 1):
+            rings_json = [json.dumps(coords[ring_offsets[ri]:ring_offsets[ri + 1]].tolist())
+                          for ri in range(poly_offsets[pi], poly_offsets[pi + 1])]
+            f.write((', ' if pi > 0 else '') + '[' + ', '.join(rings_json) + ']')
+        f.write(']}, "properties": ' + json.dumps(properties if properties is not None else {}) + '}]}')
+
+class BuildingWriter:
+    """
+    streaming writer of building outlines, one feature per building is written as soon as it is given,
+    so the whole collection is never kept in memory.
+    :param file_path:
+    :param out_format:        one of ["geojsonseq"(newline-delimited GeoJSON), "flatgeobuf", "geoparquet"]
+    :param properties_schema: {property name: "int" / "float" / "str"} of the per-building properties
+    :param round_precision:   number of decimals to keep, -1: no rounding
+    :param crs_wkt:           the crs of the coordinates (WKT), None: unknown
+    :param batch_size:        ("geoparquet" only) number of buildings per row group
+    """
+    def __init__(self, file_path:str, out_format:str="geojsonseq", properties_schema:dict=None,
+                 round_precision:int=-1, crs_wkt:str=None, batch_size:int=1000):
+        self.file_path = file_path
+        self.out_format = str.lower(out_format)
+        self.properties_schema = properties_schema if properties_schema is not None else {}
+        self.round_precision = round_precision
+        self.crs_wkt = crs_wkt
+        self.batch_size = batch_size
+        self.feature_num = 0
+        self.is_closed = False
+
+        if self.out_format == "geojsonseq":
+            self.sink = open(file_path, 'w')
+        elif self.out_format == "flatgeobuf":
+            import fiona
+            schema = {"geometry": "Polygon", "properties": self.properties_schema}
+            self.sink = fiona.open(file_path, 'w', driver="FlatGeobuf", schema=schema, crs_wkt=crs_wkt)
+        elif self.out_format == "geoparquet":
+            self.sink = None  # created with the first row group
+            self.batch_geoms, self.batch_props = [], []
+        else:
+            raise ValueError(f"the expected out_format is one of ['geojsonseq', 'flatgeobuf', 'geoparquet'], "
+                             f"but {out_format} was gotten.")
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def write(self, polygon, properties:dict=None):
+        properties = properties if properties is not None else {}
+        if self.round_precision >= 0:
+            polygon = round_geo_coords(polygon, self.round_precision)
+
+        if self.out_format == "geojsonseq":
+            self.sink.write(f'{{"type": "Feature", "geometry": {shapely.to_geojson(polygon)}, '
+                            f'"properties": {json.dumps(properties)}}}\n')
+        elif self.out_format == "flatgeobuf":
+            self.sink.write({"geometry": mapping(polygon), "properties": properties})
+        else:
+            self.batch_geoms.append(polygon)
+            self.batch_props.append(properties)
+            if len(self.batch_geoms) >= self.batch_size:
+                self.write_parquet_batch()
+        self.feature_num += 1
+
+    def write_parquet_batch(self):
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+
+        if self.sink is None:
+            pa_types = {"int": pa.int64(), "float": pa.float64(), "str": pa.string()}
+            fields = [pa.field("geometry", pa.binary())] + \
+                     [pa.field(k, pa_types[v]) for k, v in self.properties_schema.items()]
+            geo_meta = {"version": "1.0.0", "primary_column": "geometry",
+                        "columns": {"geometry": {"encoding": "WKB", "geometry_types": ["Polygon"],
+                                                 "crs": self.get_projjson()}}}
+            self.schema = pa.schema(fields, metadata={b"geo": json.dumps(geo_meta).encode()})
+            self.sink = pq.ParquetWriter(self.file_path, self.schema)
+
+        columns = [pa.array(shapely.to_wkb(np.asarray(self.batch_geoms, dtype=object)), type=pa.binary())] + \
+                  [pa.array([_.get(k) for _ in self.batch_props], type=self.schema.field(k).type)
+                   for k in self.properties_schema]
+        self.sink.write_table(pa.Table.from_arrays(columns, schema=self.schema))
+        self.batch_geoms, self.batch_props = [], []
+
+    def get_projjson(self) -> dict or None:
+        # GeoParquet expects the crs as PROJJSON, null: unknown crs
+        if self.crs_wkt is None:
+            return None
+        import pyproj
+        return pyproj.CRS.from_wkt(self.crs_wkt).to_json_dict()
+
+    def close(self):
+        if self.is_closed:
+            return
+        self.is_closed = True
+        if self.out_format == "geoparquet":
+            if len(self.batch_geoms) > 0 or self.sink is None:
+                self.write_parquet_batch()
+            self.sink.close()
+        else:
+            self.sink.close()
+
 def load_json(file_path):
     import json
     with open(file_path, 'r') as f:
-        return json.load(f)
\ No newline at end of file
+        return json.load(f)
+
+
+def hash_file(file_path, chunk_size=2 ** 23) -> str:
+    """
+    content hash (sha256) of a file, read chunk by chunk
+    :param file_path:
+    :param chunk_size: bytes read per chunk
+    :return:
+        the hex digest
+    """
+    file_hash = hashlib.sha256()
+    with open(file_path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            file_hash.update(chunk)
+    return file_hash.hexdigest()
+
+
+class DiskCache:
+    """
+    size-bounded on-disk cache of numpy arrays, one .npz file per key.
+    When the total size exceeds max_size_mb, the least recently used entries are evicted until it is
+    <= evict_ratio * max_size_mb. The total size is tracked on save, and the folder is only scanned at init and
+    on eviction (which also picks up the files saved by other processes).
+    :param cache_folder: the folder saving the cache files
+    :param max_size_mb:  the max. total size of the cache files (MB)
+    :param evict_ratio:  the ratio of the total size to max_size_mb after eviction
+    """
+    def __init__(self, cache_folder:str, max_size_mb:float=1024, evict_ratio:float=0.8):
+        if not 0 <= evict_ratio <= 1:
+            raise ValueError(f"The expected 'evict_ratio' is in [0, 1], but {evict_ratio} was gotten.")
+        self.cache_folder = create_folder(cache_folder)
+        self.max_size = max_size_mb * 2 ** 20
+        self.evict_ratio = evict_ratio
+        self.total_size = sum(_[1] for _ in self.get_cache_files())
+
+    def get_path(self, key:str) -> str:
+        return os.path.join(self.cache_folder, f"{key}.npz")
+
+    def get_cache_files(self) -> list:
+        """
+        :return:
+            list of (mtime, size, path) of the cache files
+        """
+        cache_files = []
+        for cache_path in glob.glob(os.path.join(self.cache_folder, "*.npz")):
+            try:
+                cache_stat = os.stat(cache_path)
+            except OSError:
+                continue
+            cache_files.append((cache_stat.st_mtime, cache_stat.st_size, cache_path))
+        return cache_files
+
+    def load(self, key:str) -> dict or None:
+        """
+        :param key:
+        :return:
+            dict of arrays saved with the key, None if the key is not cached
+        """
+        cache_path = self.get_path(key)
+        try:
+            with np.load(cache_path, allow_pickle=False) as cache_data:
+                arrs = {k: cache_data[k] for k in cache_data.files}
+            os.utime(cache_path)  # mark as recently used
+        except (OSError, ValueError, zipfile.BadZipFile):  # not cached, or evicted / being written by another process
+            return None
+        return arrs
+
+    def save(self, key:str, **arrs):
+        # write to a temporary file first, so that other processes never load a partly written file
+        fd, tmp_path = tempfile.mkstemp(suffix=".npz.tmp", dir=self.cache_folder)
+        with os.fdopen(fd, 'wb') as f:
+            np.savez(f, **arrs)
+            cache_size = f.tell()
+        cache_path = self.get_path(key)
+        try:
+            self.total_size -= os.stat(cache_path).st_size  # overwritten
+        except OSError:
+            pass
+        os.replace(tmp_path, cache_path)
+        self.total_size += cache_size
+        if self.total_size > self.max_size:
+            self.evict()
+
+    def evict(self):
+        cache_files = self.get_cache_files()
+        total_size = sum(_[1] for _ in cache_files)
+        for _, cache_size, cache_path in sorted(cache_files):  # oldest first
+            if total_size <= self.evict_ratio * self.max_size:
+                break
+            try:
+                os.remove(cache_path)
+            except OSError:
+                pass
+            total_size -= cache_size
+        self.total_size = total_size